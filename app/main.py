@@ -1,60 +1,169 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request
+from fastapi import FastAPI, Depends, HTTPException, status, Request, WebSocket
+from starlette.background import BackgroundTask
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
+from contextlib import asynccontextmanager
+import asyncio
+import json
 import os
 from dotenv import load_dotenv
 
-from .models.database import init_db, engine, SessionLocal, User
-from .services.graph_db import GraphService
+from .models.database import init_db_async, get_db, session_scope, sync_engine, DBSession
+from .services.graph_db import create_graph_service
 from .services.claude_service import ClaudeService
+from .services.query_cache import create_query_cache
 from .services.auth import (
+    CurrentUser,
+    get_auth_cache_stats,
     get_current_user,
+    get_user_from_token,
     authenticate_user,
     create_access_token,
     get_password_hash,
+    password_hasher,
     ACCESS_TOKEN_EXPIRE_MINUTES,
 )
 from .services.message_service import MessageService
+from .services.message_archive import MessageArchive
 from .services.profile_service import ProfileService
+from .services.profile_cache import profile_cache
+from .services.characteristic_writer import CharacteristicWriter
+from .services.realtime import ConnectionHub, create_broker
+from .services.similarity_index import SimilarityIndex
+from .services.extraction_pipeline import ExtractionJob, ExtractionPipeline
+from .services.extraction_batcher import ExtractionBatcher
+from .services.conversation_memory import ConversationMemoryService
+from .services.characteristic_parser import ReplyStreamFilter
+from .services.metrics import REGISTRY
+from .services.request_metrics import MetricsMiddleware, install_sql_counter
 
 load_dotenv()
 
-app = FastAPI()
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
-
 # Initialize services
-graph_service = GraphService()
-claude_service = ClaudeService()
+# GRAPH_BACKEND=memory swaps Neo4j for an in-process graph; the driver itself is opened in the lifespan
+graph_service = create_graph_service()
+claude_service = ClaudeService(query_cache=create_query_cache())
+characteristic_writer = CharacteristicWriter(
+    graph_service,
+    flush_interval=float(os.getenv("CHARACTERISTIC_FLUSH_INTERVAL", "1.0")),
+    max_batch=int(os.getenv("CHARACTERISTIC_MAX_BATCH", "500")),
+    on_written=lambda usernames: profile_cache.invalidate_many(int(name) for name in usernames if name.isdigit()),
+)
+# Old messages moved out of SQLite by archive_messages.py; get_conversation pages into them
+message_archive = MessageArchive()
+similarity_index = SimilarityIndex(max_postings=int(os.getenv("SIMILARITY_MAX_POSTINGS", "5000")))
+connection_hub = ConnectionHub(create_broker(), max_queue=int(os.getenv("REALTIME_MAX_QUEUE", "100")))
 
-# Database dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# "reply" parses characteristics out of the chat reply; "batched" sends the user's
+# messages to Claude in shared extraction-only requests
+EXTRACTION_MODE = claude_service.extraction_mode
+extraction_batcher = ExtractionBatcher(
+    claude_service,
+    max_batch=int(os.getenv("EXTRACTION_BATCH_SIZE", "20")),
+    max_wait=float(os.getenv("EXTRACTION_BATCH_WINDOW", "0.05")),
+)
+
+async def extract_job_characteristics(job: ExtractionJob) -> List[Tuple[str, str]]:
+    if EXTRACTION_MODE == "batched":
+        # The chat reply was generated without extraction instructions, so it is never parsed
+        if not job.message:
+            return []
+        return await extraction_batcher.extract(f"{job.user_id}:{job.job_id}", job.message)
+    return await claude_service.extract_characteristics(job.text)
+
+def persist_characteristics(user_id: int, characteristics: List[Tuple[str, str]]) -> None:
+    # Characteristic updates only touch the graph side, so no database session is needed
+    ProfileService(None, graph_service, characteristic_writer, similarity_index, profile_cache).update_user_characteristics(
+        user_id, characteristics
+    )
+
+async def load_user_characteristics(user_id: int) -> Dict[str, str]:
+    return await asyncio.to_thread(graph_service.get_user_characteristics, str(user_id))
+
+extraction_pipeline = ExtractionPipeline(
+    extract_job_characteristics,
+    persist_characteristics,
+    load_user_characteristics,
+    max_queue=int(os.getenv("EXTRACTION_MAX_QUEUE", "1000")),
+    # A batch can only fill up if enough workers are waiting on it at once
+    workers=max(
+        int(os.getenv("EXTRACTION_WORKERS", "2")),
+        extraction_batcher.max_batch if EXTRACTION_MODE == "batched" else 0
+    ),
+    max_retries=int(os.getenv("EXTRACTION_MAX_RETRIES", "3")),
+    retry_delay=float(os.getenv("EXTRACTION_RETRY_DELAY", "0.5")),
+)
+
+# Existing service counters are exported as gauges on /metrics
+install_sql_counter(sync_engine)
+REGISTRY.collector("claude", claude_service.get_stats)
+REGISTRY.collector("extraction_pipeline", extraction_pipeline.get_stats)
+REGISTRY.collector("extraction_batcher", extraction_batcher.get_stats)
+REGISTRY.collector("characteristic_writer", characteristic_writer.get_stats)
+REGISTRY.collector("similarity_index", similarity_index.get_stats)
+REGISTRY.collector("realtime", connection_hub.get_stats)
+REGISTRY.collector("password_hasher", password_hasher.get_stats)
+REGISTRY.collector("auth_token_cache", lambda: get_auth_cache_stats()["tokens"])
+REGISTRY.collector("auth_user_cache", lambda: get_auth_cache_stats()["users"])
+REGISTRY.collector("profile_cache", profile_cache.get_stats)
+REGISTRY.collector("message_archive", message_archive.get_stats)
+if claude_service.query_cache:
+    REGISTRY.collector("query_cache", claude_service.query_cache.get_stats)
 
 # Service dependencies
-def get_message_service(db: Session = Depends(get_db)) -> MessageService:
-    return MessageService(db)
+def get_message_service(db: DBSession = Depends(get_db)) -> MessageService:
+    return MessageService(db, connection_hub, message_archive)
+
+def get_profile_service(db: DBSession = Depends(get_db)) -> ProfileService:
+    return ProfileService(db, graph_service, characteristic_writer, similarity_index, profile_cache)
+
+def get_memory_service(db: DBSession = Depends(get_db)) -> ConversationMemoryService:
+    return ConversationMemoryService(db)
 
-def get_profile_service(db: Session = Depends(get_db)) -> ProfileService:
-    return ProfileService(db, graph_service)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The application owns the single graph driver shared by every service
+    graph_service.connect()
+    # Unreachable Neo4j is reported but not fatal; the driver reconnects on demand
+    await asyncio.to_thread(graph_service.check_connectivity)
+    await init_db_async()
+    await characteristic_writer.start()
+    await extraction_pipeline.start()
+    await connection_hub.start()
+    await similarity_index.start(
+        graph_service, float(os.getenv("SIMILARITY_REBUILD_INTERVAL", "3600")), characteristic_writer
+    )
+    try:
+        yield
+    finally:
+        await connection_hub.stop()
+        await similarity_index.stop()
+        # Drain extraction before the writer so its last characteristics get flushed
+        await extraction_pipeline.stop()
+        await extraction_batcher.close()
+        await characteristic_writer.stop()
+        await claude_service.close()
+        graph_service.close()
+        password_hasher.shutdown()
 
-# Initialize database
-init_db()
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+app.mount("/static", StaticFiles(directory="static"), name="static")
+templates = Jinja2Templates(directory="templates")
 
 # Routes
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
     return templates.TemplateResponse("chat.html", {"request": request})
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
@@ -62,9 +171,9 @@ async def login_page(request: Request):
 @app.post("/token")
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: DBSession = Depends(get_db)
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -84,9 +193,9 @@ async def register(
     password: str,
     profile_service: ProfileService = Depends(get_profile_service)
 ):
-    hashed_password = get_password_hash(password)
+    hashed_password = await get_password_hash(password)
     try:
-        user = profile_service.create_user(username, email, hashed_password)
+        user = await profile_service.create_user(username, email, hashed_password)
         return {"id": user.id, "username": user.username}
     except Exception as e:
         raise HTTPException(
@@ -97,29 +206,76 @@ async def register(
 @app.post("/api/chat")
 async def chat(
     message: str,
-    current_user: User = Depends(get_current_user),
-    profile_service: ProfileService = Depends(get_profile_service)
+    current_user: CurrentUser = Depends(get_current_user),
+    memory_service: ConversationMemoryService = Depends(get_memory_service)
 ):
-    # Process message with Claude
-    response, characteristics = await claude_service.process_message(str(current_user.id), message)
+    # Process message with Claude, including the recent turns and summary of earlier ones
+    context = await memory_service.get_context(current_user.id)
+    raw_response = await claude_service.process_message(str(current_user.id), message, context)
+    await memory_service.record_exchange(current_user.id, message, raw_response)
     
-    # Store extracted characteristics
-    if characteristics:
-        profile_service.update_user_characteristics(current_user.id, characteristics)
+    # Characteristics are extracted from the reply's structured block in the background
+    extraction_pipeline.submit(current_user.id, raw_response, message)
     
-    return {"response": response}
+    return {"response": claude_service.reply_text(raw_response)}
+
+async def finish_streamed_reply(user_id: int, message: str, chunks: List[str]):
+    reply = "".join(chunks)
+    extraction_pipeline.submit(user_id, reply, message)
+    # The request's session is gone by now, so the exchange is recorded in a fresh one
+    async with session_scope() as db:
+        await ConversationMemoryService(db).record_exchange(user_id, message, reply)
+
+@app.post("/api/chat/stream")
+async def chat_stream(
+    message: str,
+    current_user: CurrentUser = Depends(get_current_user),
+    memory_service: ConversationMemoryService = Depends(get_memory_service)
+):
+    chunks = []
+    # Admission is decided before the stream starts, while a 429 can still be sent
+    claude_service.scheduler.admit(str(current_user.id), "chat")
+    context = await memory_service.get_context(current_user.id)
+
+    async def events():
+        # The characteristics block at the end of the reply is kept from the client
+        reply_filter = ReplyStreamFilter() if claude_service.reply_has_characteristics() else None
+        async for text in claude_service.stream_message(str(current_user.id), message, context, admitted=True):
+            chunks.append(text)
+            visible = reply_filter.feed(text) if reply_filter else text
+            if visible:
+                yield f"data: {json.dumps({'token': visible})}\n\n"
+        remainder = reply_filter.flush() if reply_filter else ""
+        if remainder:
+            yield f"data: {json.dumps({'token': remainder})}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    # The full reply is remembered and handed to the extraction pipeline once the stream has closed
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(finish_streamed_reply, current_user.id, message, chunks),
+    )
 
 @app.post("/api/search-users")
 async def search_users(
     query: str,
-    current_user: User = Depends(get_current_user),
+    limit: int = 20,
+    mode: str = "ranked",
+    current_user: CurrentUser = Depends(get_current_user),
     profile_service: ProfileService = Depends(get_profile_service)
 ):
     # Convert search query to characteristics using Claude
-    search_criteria = await claude_service.find_matching_users(query)
+    search_criteria = await claude_service.find_matching_users(query, str(current_user.id))
     
-    # Find matching users
-    matching_users = profile_service.search_users(search_criteria, exclude_user_id=current_user.id)
+    # Find matching users: ranked partial matches by default, "exact" requires every criterion
+    matching_users = await profile_service.search_users(
+        search_criteria,
+        exclude_user_id=current_user.id,
+        limit=max(1, min(limit, 100)),
+        ranked=mode != "exact"
+    )
     
     return {"users": matching_users}
 
@@ -127,10 +283,10 @@ async def search_users(
 async def send_message(
     recipient_id: int,
     content: str,
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     message_service: MessageService = Depends(get_message_service)
 ):
-    message = message_service.create_message(current_user.id, recipient_id, content)
+    message = await message_service.create_message(current_user.id, recipient_id, content)
     return {
         "id": message.id,
         "content": message.content,
@@ -140,33 +296,86 @@ async def send_message(
 @app.get("/api/messages/{other_user_id}")
 async def get_messages(
     other_user_id: int,
-    current_user: User = Depends(get_current_user),
+    limit: int = 50,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    current_user: CurrentUser = Depends(get_current_user),
     message_service: MessageService = Depends(get_message_service)
 ):
-    messages = message_service.get_conversation(current_user.id, other_user_id)
-    message_service.mark_messages_as_read(current_user.id, other_user_id)
-    return {"messages": messages}
+    limit = max(1, min(limit, 200))
+    messages = await message_service.get_conversation(
+        current_user.id, other_user_id, limit=limit, before=before, after=after
+    )
+    await message_service.mark_messages_as_read(current_user.id, other_user_id)
+    return {
+        "messages": messages,
+        "before": messages[-1].id if len(messages) == limit else None,
+        "after": messages[0].id if messages else after
+    }
+
+@app.get("/api/search-messages")
+async def search_messages(
+    q: str,
+    with_user: Optional[int] = None,
+    limit: int = 20,
+    offset: int = 0,
+    current_user: CurrentUser = Depends(get_current_user),
+    message_service: MessageService = Depends(get_message_service)
+):
+    if not message_service.search_available:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Message search requires the SQLite backend"
+        )
+    limit = max(1, min(limit, 100))
+    offset = max(0, offset)
+    # One extra row tells whether another page exists
+    results = await message_service.search_messages(
+        current_user.id, q, other_user_id=with_user, limit=limit + 1, offset=offset
+    )
+    next_offset = offset + limit if len(results) > limit else None
+    return {"results": results[:limit], "next_offset": next_offset}
 
 @app.get("/api/conversations")
 async def get_conversations(
-    current_user: User = Depends(get_current_user),
+    limit: int = 20,
+    cursor: Optional[int] = None,
+    current_user: CurrentUser = Depends(get_current_user),
     message_service: MessageService = Depends(get_message_service)
 ):
-    return {"conversations": message_service.get_user_conversations(current_user.id)}
+    limit = max(1, min(limit, 100))
+    conversations = await message_service.get_user_conversations(current_user.id, limit=limit, before=cursor)
+    next_cursor = conversations[-1]["last_message"]["id"] if len(conversations) == limit else None
+    return {"conversations": conversations, "next_cursor": next_cursor}
+
+@app.websocket("/ws")
+async def realtime_updates(websocket: WebSocket, token: str):
+    # The session is only held for authentication, not for the socket lifetime
+    async with session_scope() as db:
+        try:
+            user = await get_user_from_token(db, token)
+        except HTTPException:
+            user = None
+    if user is None:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    await connection_hub.serve(user.id, websocket)
 
 @app.get("/api/profile")
 async def get_profile(
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     profile_service: ProfileService = Depends(get_profile_service)
 ):
-    return profile_service.get_user_profile(current_user.id)
+    return await profile_service.get_user_profile(current_user.id)
 
 @app.get("/api/suggestions")
 async def get_suggestions(
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     profile_service: ProfileService = Depends(get_profile_service)
 ):
-    return {"suggestions": profile_service.get_user_suggestions(current_user.id)}
+    return {"suggestions": await profile_service.get_user_suggestions(current_user.id)}
 
 if __name__ == "__main__":
     import uvicorn
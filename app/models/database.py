@@ -1,7 +1,15 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import create_engine, event, Column, Integer, String, DateTime, ForeignKey, Text, Boolean, Index
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import relationship, sessionmaker, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from datetime import datetime
+from typing import Union
+from contextlib import asynccontextmanager
+import asyncio
+import functools
+import os
 
 Base = declarative_base()
 
@@ -29,10 +37,261 @@ class Message(Base):
     sender = relationship("User", back_populates="messages_sent", foreign_keys=[sender_id])
     recipient = relationship("User", back_populates="messages_received", foreign_keys=[recipient_id])
 
+    __table_args__ = (
+        # Conversation history: both directions of a pair resolve to range scans on this index
+        Index("ix_messages_sender_recipient_id", "sender_id", "recipient_id", "id"),
+        # Inbox lookups for messages received by a user
+        Index("ix_messages_recipient_sender_id", "recipient_id", "sender_id", "id"),
+        # Only unread rows are indexed, which keeps mark_messages_as_read cheap
+        Index(
+            "ix_messages_unread",
+            "recipient_id",
+            "sender_id",
+            sqlite_where=(read == False),
+            postgresql_where=(read == False),
+        ),
+    )
+
+class ConversationTurn(Base):
+    __tablename__ = "conversation_turns"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    role = Column(String(20), nullable=False)
+    content = Column(Text, nullable=False)
+    tokens = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # The rolling window is always read and compacted oldest-first per user
+        Index("ix_conversation_turns_user_id", "user_id", "id"),
+    )
+
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    summary = Column(Text, nullable=False, default="")
+    tokens = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# Messages moved to cold storage live in compressed segment files (see
+# services/message_archive.py). These small tables are the index into them:
+# one row per compressed block, plus tombstones for deleted archived messages.
+class ArchiveBlock(Base):
+    __tablename__ = "message_archive_blocks"
+
+    id = Column(Integer, primary_key=True)
+    # A conversation is the ordered user pair, lower id first
+    user_lo = Column(Integer, nullable=False)
+    user_hi = Column(Integer, nullable=False)
+    segment = Column(String(255), nullable=False)
+    offset = Column(Integer, nullable=False)
+    length = Column(Integer, nullable=False)
+    first_id = Column(Integer, nullable=False)
+    last_id = Column(Integer, nullable=False)
+    count = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_message_archive_blocks_conversation", "user_lo", "user_hi", "last_id"),
+        Index("ix_message_archive_blocks_last_id", "last_id"),
+        # Never hand a deleted block's id to a new block; tombstones and caches refer to ids
+        {"sqlite_autoincrement": True},
+    )
+
+class ArchiveDeletion(Base):
+    __tablename__ = "message_archive_deletions"
+
+    message_id = Column(Integer, primary_key=True)
+    block_id = Column(Integer, ForeignKey("message_archive_blocks.id"), nullable=False, index=True)
+
 # Database connection
-SQLALCHEMY_DATABASE_URL = "sqlite:///./chatbot.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Any SQLAlchemy URL works; async drivers such as sqlite+aiosqlite:// or
+# postgresql+asyncpg:// switch the app onto an AsyncEngine
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./chatbot.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+DBSession = Union[Session, AsyncSession]
+
+def _engine_options(url, is_async: bool) -> dict:
+    options = {}
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+        if url.database in (None, "", ":memory:"):
+            # In-memory databases use a single shared connection, pool sizing does not apply
+            return options
+        if is_async:
+            # aiosqlite defaults to NullPool, which reconnects on every checkout
+            options["poolclass"] = AsyncAdaptedQueuePool
+    options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+    return options
+
+_url = make_url(SQLALCHEMY_DATABASE_URL)
+IS_ASYNC = _url.get_dialect().is_async
+
+if IS_ASYNC:
+    engine = create_async_engine(_url, **_engine_options(_url, IS_ASYNC))
+    sync_engine = engine.sync_engine
+    SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+else:
+    engine = create_engine(_url, **_engine_options(_url, IS_ASYNC))
+    sync_engine = engine
+    # Loaded rows stay usable after commit without another round-trip
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+def create_script_engine():
+    # Maintenance scripts run plain blocking code; with an async driver they get
+    # their own engine on the backend's default sync driver for the same database
+    if not IS_ASYNC:
+        return sync_engine
+    script_engine = create_engine(_url.set(drivername=_url.get_backend_name()))
+    if _url.get_backend_name() == "sqlite":
+        event.listen(script_engine, "connect", _set_sqlite_pragmas)
+    return script_engine
+
+if _url.get_backend_name() == "sqlite":
+    @event.listens_for(sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL lets readers proceed while a write is in progress
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
+
+@asynccontextmanager
+async def session_scope():
+    if IS_ASYNC:
+        async with SessionLocal() as db:
+            yield db
+    else:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+async def get_db():
+    async with session_scope() as db:
+        yield db
+
+async def run_db(db: DBSession, fn, *args, **kwargs):
+    # Runs fn(session, ...) against either backend without blocking the event loop:
+    # AsyncSession drives the sync ORM code through run_sync, a plain Session
+    # is handed to a worker thread
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await asyncio.to_thread(fn, db, *args, **kwargs)
+
+def run_in_session(method):
+    # Turns a sync service method taking (self, db, ...) into a coroutine taking (self, ...)
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        return await run_db(self.db, functools.partial(method, self), *args, **kwargs)
+    return wrapper
 
 def init_db():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    if IS_ASYNC:
+        asyncio.run(_init_db_and_dispose())
+        return
+    with engine.begin() as connection:
+        create_schema(connection)
+
+async def init_db_async():
+    if IS_ASYNC:
+        async with engine.begin() as connection:
+            await connection.run_sync(create_schema)
+    else:
+        await asyncio.to_thread(init_db)
+
+async def _init_db_and_dispose():
+    await init_db_async()
+    # Pooled connections are bound to this temporary event loop
+    await engine.dispose()
+
+def create_schema(connection):
+    Base.metadata.create_all(bind=connection)
+    migrate_db(connection)
+
+def migrate_db(connection):
+    # create_all skips indexes on tables that already exist, so existing
+    # chatbot.db files pick up new indexes here
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
+    if connection.dialect.name == "sqlite":
+        create_message_search(connection)
+
+# Full-text message search (SQLite only). messages_fts is an external-content
+# FTS5 index over a view of messages, so message text is stored once. The
+# participants column holds "u<sender> u<recipient>", which lets a search be
+# scoped to one user's conversations inside the index instead of filtering
+# every match afterwards.
+MESSAGE_SEARCH_AVAILABLE = _url.get_backend_name() == "sqlite"
+_PARTICIPANTS = "'u' || {row}.sender_id || ' u' || {row}.recipient_id"
+MESSAGE_SEARCH_DDL = [
+    "CREATE VIEW IF NOT EXISTS messages_search_source AS "
+    "SELECT id, content, 'u' || sender_id || ' u' || recipient_id AS participants FROM messages",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    "content, participants, content='messages_search_source', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts(rowid, content, participants) "
+    f"VALUES (new.id, new.content, {_PARTICIPANTS.format(row='new')}); END",
+]
+# FTS5 reports a corrupt database when asked to delete a row it never indexed,
+# so these are only installed once the index covers every existing message
+MESSAGE_SEARCH_SYNC_DDL = [
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content, participants) "
+    f"VALUES ('delete', old.id, old.content, {_PARTICIPANTS.format(row='old')}); END",
+    # Marking messages read does not touch the index
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content, sender_id, recipient_id ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content, participants) "
+    f"VALUES ('delete', old.id, old.content, {_PARTICIPANTS.format(row='old')}); "
+    "INSERT INTO messages_fts(rowid, content, participants) "
+    f"VALUES (new.id, new.content, {_PARTICIPANTS.format(row='new')}); END",
+]
+
+def create_message_search(connection) -> None:
+    try:
+        for statement in MESSAGE_SEARCH_DDL:
+            connection.exec_driver_sql(statement)
+    except Exception as e:
+        print(f"Error creating message search index (is FTS5 available?): {e}")
+        raise
+    # A complete index covers the oldest message; the docsize table has one row per indexed message
+    incomplete = connection.exec_driver_sql(
+        "SELECT 1 FROM messages WHERE id = (SELECT min(id) FROM messages) "
+        "AND id NOT IN (SELECT id FROM messages_fts_docsize)"
+    ).first() is not None
+    if incomplete:
+        # Indexing a large history can take minutes, so it is not done at startup.
+        # Until then deletes and edits leave the index alone instead of failing.
+        connection.exec_driver_sql("DROP TRIGGER IF EXISTS messages_fts_delete")
+        connection.exec_driver_sql("DROP TRIGGER IF EXISTS messages_fts_update")
+        print("Message search index is incomplete; run python build_search_index.py to index existing messages")
+    else:
+        _create_message_search_sync(connection)
+
+def _create_message_search_sync(connection) -> None:
+    for statement in MESSAGE_SEARCH_SYNC_DDL:
+        connection.exec_driver_sql(statement)
+
+def rebuild_message_search(connection) -> int:
+    # Re-reads every message in one pass, far faster than row-by-row inserts
+    create_message_search(connection)
+    connection.exec_driver_sql("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+    _create_message_search_sync(connection)
+    connection.exec_driver_sql("INSERT INTO messages_fts(messages_fts) VALUES ('optimize')")
+    return connection.exec_driver_sql("SELECT count(*) FROM messages").scalar()
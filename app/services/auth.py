@@ -1,41 +1,134 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import event, inspect
 from sqlalchemy.orm import Session
+import asyncio
 import os
+import time
 
-from ..models.database import User, SessionLocal
+from ..models.database import DBSession, User, get_db, run_db
+from .cache import LRUCache
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-keep-it-secret")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Pinning min and max rounds to the configured cost makes verify_and_update
+# flag any stored hash made with a different cost for rehashing
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Lightweight record handed to routes instead of a session-bound User row
+@dataclass(frozen=True)
+class CurrentUser:
+    id: int
+    username: str
+    email: str
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+# Decoded tokens map to a username, and usernames map to user records, so
+# invalidating a user drops it for every token without tracking them all
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+token_cache = LRUCache(max_size=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+user_cache = LRUCache(max_size=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+def invalidate_user(username: str) -> None:
+    user_cache.delete(username)
 
-def get_user(db: Session, username: str) -> Optional[User]:
+def get_auth_cache_stats() -> Dict[str, Dict[str, float]]:
+    return {"tokens": token_cache.get_stats(), "users": user_cache.get_stats()}
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target: User) -> None:
+    invalidate_user(target.username)
+    # A renamed user must not stay reachable under the old name
+    for old_username in inspect(target).attrs.username.history.deleted:
+        invalidate_user(old_username)
+
+# bcrypt releases the GIL, so a thread pool keeps hashing off the event loop
+# while the admission limit turns a login storm into fast 503s instead of a
+# queue that stalls every other request
+class PasswordHasher:
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash") if workers else None
+        self.pending = 0
+        self.stats = {"hashed": 0, "verified": 0, "rehashed": 0, "rejected": 0}
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many password checks in progress",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            if self.executor is None:
+                return fn(*args)
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self) -> None:
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats, pending=self.pending, workers=self.workers)
+
+password_hasher = PasswordHasher(
+    workers=int(os.getenv("PASSWORD_HASH_WORKERS", "4")),
+    max_pending=int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64")),
+)
+
+async def verify_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    # Returns (valid, new_hash); new_hash is set when the stored hash uses outdated parameters
+    password_hasher.stats["verified"] += 1
+    return await password_hasher.run(pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def get_password_hash(password: str) -> str:
+    password_hasher.stats["hashed"] += 1
+    return await password_hasher.run(pwd_context.hash, password)
+
+def _get_user(db: Session, username: str) -> Optional[User]:
     return db.query(User).filter(User.username == username).first()
 
-def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
-    user = get_user(db, username)
-    if not user or not verify_password(password, user.hashed_password):
+async def get_user(db: DBSession, username: str) -> Optional[User]:
+    return await run_db(db, _get_user, username)
+
+def _update_password_hash(db: Session, user: User, hashed_password: str) -> None:
+    user.hashed_password = hashed_password
+    db.add(user)
+    db.commit()
+
+async def authenticate_user(db: DBSession, username: str, password: str) -> Optional[User]:
+    user = await get_user(db, username)
+    if not user:
+        return None
+    valid, new_hash = await verify_password(password, user.hashed_password)
+    if not valid:
         return None
+    if new_hash:
+        # Transparently upgrade hashes made with a different bcrypt cost
+        await run_db(db, _update_password_hash, user, new_hash)
+        password_hasher.stats["rehashed"] += 1
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -48,21 +141,33 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+# Uses the same get_db as the routes, so FastAPI hands both the same session
+async def get_current_user(token: str = Depends(oauth2_scheme), db: DBSession = Depends(get_db)) -> CurrentUser:
+    return await get_user_from_token(db, token)
+
+async def get_user_from_token(db: DBSession, token: str) -> CurrentUser:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    username = token_cache.get(token)
+    if username is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+        except JWTError:
+            raise credentials_exception
+        # Never cache a token past its own expiry
+        token_cache.set(token, username, ttl=min(AUTH_CACHE_TTL, payload["exp"] - time.time()))
+
+    current_user = user_cache.get(username)
+    if current_user is None:
+        user = await get_user(db, username)
+        if user is None:
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    user = get_user(db, username)
-    if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
+        current_user = CurrentUser(id=user.id, username=user.username, email=user.email)
+        user_cache.set(username, current_user)
+    return current_user
\ No newline at end of file
@@ -0,0 +1,111 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import json
+import os
+import re
+
+from .vocabulary import CANONICAL_KEYS, canonical_key
+
+# Claude ends each reply with the characteristics it found as tagged JSON:
+#   <characteristics>[{"key": "interest", "value": "chess", "confidence": 0.9}]</characteristics>
+# Only that block is parsed, so prose such as "Note: you seem..." never turns
+# into a characteristic.
+OPEN_TAG = "<characteristics>"
+CLOSE_TAG = "</characteristics>"
+
+MIN_CONFIDENCE = float(os.getenv("CHARACTERISTIC_MIN_CONFIDENCE", "0.6"))
+MAX_VALUE_LENGTH = 80
+MAX_VALUE_WORDS = 6
+
+def split_reply(raw: str) -> Tuple[str, Optional[str]]:
+    # Returns the user-facing reply and the block's payload, or None without a block
+    start = raw.find(OPEN_TAG)
+    if start == -1:
+        return raw.strip(), None
+    end = raw.find(CLOSE_TAG, start)
+    payload = raw[start + len(OPEN_TAG):end if end != -1 else len(raw)]
+    return raw[:start].strip(), payload.strip()
+
+def parse_characteristics(payload: Any, min_confidence: float = MIN_CONFIDENCE) -> List[Tuple[str, str]]:
+    # (key, value) pairs in reply order; a key can hold several values ("interest: hiking", "interest: chess")
+    if isinstance(payload, str):
+        try:
+            payload = json.loads(payload) if payload else []
+        except ValueError:
+            return []
+
+    characteristics: List[Tuple[str, str]] = []
+    for key, value, confidence in _candidates(payload):
+        key = canonical_key(str(key))
+        value = _clean_value(value)
+        if key not in CANONICAL_KEYS or value is None or confidence < min_confidence:
+            continue
+        if (key, value) not in characteristics:
+            characteristics.append((key, value))
+    return characteristics
+
+def extract_characteristics(raw: str, min_confidence: float = MIN_CONFIDENCE) -> List[Tuple[str, str]]:
+    _, payload = split_reply(raw)
+    if payload is None:
+        return []
+    return parse_characteristics(payload, min_confidence)
+
+def _candidates(payload: Any) -> Iterable[Tuple[Any, Any, float]]:
+    # Accepts [{"key", "value", "confidence"}], {"key": "value"} and {"key": {"value", "confidence"}}
+    if isinstance(payload, dict):
+        items = [
+            dict(value, key=key) if isinstance(value, dict) else {"key": key, "value": value}
+            for key, value in payload.items()
+        ]
+    elif isinstance(payload, list):
+        items = payload
+    else:
+        return []
+
+    candidates = []
+    for item in items:
+        if not isinstance(item, dict) or "key" not in item:
+            continue
+        try:
+            confidence = float(item.get("confidence", 1.0))
+        except (TypeError, ValueError):
+            continue
+        candidates.append((item["key"], item.get("value"), confidence))
+    return candidates
+
+def _clean_value(value: Any) -> Optional[str]:
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        return None
+    value = re.sub(r"\s+", " ", str(value)).strip().rstrip(".!")
+    if not value or len(value) > MAX_VALUE_LENGTH or len(value.split()) > MAX_VALUE_WORDS:
+        return None
+    return value
+
+# Forwards streamed reply text while holding back the characteristics block,
+# including a partially received opening tag
+class ReplyStreamFilter:
+    def __init__(self):
+        self._buffer = ""
+        self._closed = False
+
+    def feed(self, text: str) -> str:
+        if self._closed:
+            return ""
+        self._buffer += text
+        index = self._buffer.find(OPEN_TAG)
+        if index != -1:
+            visible, self._buffer, self._closed = self._buffer[:index].rstrip(), "", True
+            return visible
+
+        held = 0
+        for size in range(min(len(OPEN_TAG) - 1, len(self._buffer)), 0, -1):
+            if OPEN_TAG.startswith(self._buffer[-size:]):
+                held = size
+                break
+        # Trailing whitespace is held too, in case the block follows it
+        visible = self._buffer[:len(self._buffer) - held].rstrip()
+        self._buffer = self._buffer[len(visible):]
+        return visible
+
+    def flush(self) -> str:
+        visible, self._buffer = ("" if self._closed else self._buffer), ""
+        return visible
@@ -0,0 +1,118 @@
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import asyncio
+import threading
+
+from .graph_db import GraphService
+
+# Write-behind queue that coalesces characteristic writes from many chat turns
+# into periodic UNWIND batches against Neo4j
+class CharacteristicWriter:
+    def __init__(
+        self,
+        graph_service: GraphService,
+        flush_interval: float = 1.0,
+        max_batch: int = 500,
+        on_written: Optional[Callable[[List[str]], None]] = None
+    ):
+        self.graph_service = graph_service
+        # Called with the usernames of each batch once it is in the graph
+        self.on_written = on_written
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pending: Dict[str, Set[Tuple[str, str]]] = {}
+        self._pending_rows = 0
+        self._lock = threading.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"submitted": 0, "coalesced": 0, "written": 0, "batches": 0, "failed_batches": 0}
+
+    def submit(self, username: str, characteristics: List[Tuple[str, str]]) -> None:
+        with self._lock:
+            pairs = self._pending.setdefault(username, set())
+            for char, value in characteristics:
+                self.stats["submitted"] += 1
+                if (char, value) in pairs:
+                    self.stats["coalesced"] += 1
+                    continue
+                pairs.add((char, value))
+                self._pending_rows += 1
+            full = self._pending_rows >= self.max_batch
+        if full and self._loop:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def pending(self) -> int:
+        return self._pending_rows
+
+    def pending_characteristics(self) -> Dict[str, Set[Tuple[str, str]]]:
+        with self._lock:
+            return {username: set(pairs) for username, pairs in self._pending.items()}
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats, pending=self._pending_rows)
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Drain everything still pending before the process exits
+        for _ in range(3):
+            await self.flush()
+            if not self._pending_rows:
+                break
+        if self._pending_rows:
+            print(f"Dropping {self._pending_rows} characteristic writes that could not be flushed")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def _take_rows(self) -> List[Dict[str, str]]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._pending_rows = 0
+        return [
+            {"username": username, "name": char, "value": value}
+            for username, pairs in pending.items()
+            for char, value in pairs
+        ]
+
+    def _restore_rows(self, rows: List[Dict[str, str]]) -> None:
+        with self._lock:
+            for row in rows:
+                pairs = self._pending.setdefault(row["username"], set())
+                if (row["name"], row["value"]) not in pairs:
+                    pairs.add((row["name"], row["value"]))
+                    self._pending_rows += 1
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            rows = self._take_rows()
+            for start in range(0, len(rows), self.max_batch):
+                batch = rows[start:start + self.max_batch]
+                try:
+                    await asyncio.to_thread(self.graph_service.add_characteristics_batch, batch)
+                    self.stats["batches"] += 1
+                    self.stats["written"] += len(batch)
+                    if self.on_written:
+                        self.on_written(list({row["username"] for row in batch}))
+                except Exception as e:
+                    print(f"Error flushing characteristics: {e}")
+                    self.stats["failed_batches"] += 1
+                    # Keep unwritten rows for the next flush instead of losing them
+                    self._restore_rows(rows[start:])
+                    return
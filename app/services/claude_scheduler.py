@@ -0,0 +1,201 @@
+from contextlib import asynccontextmanager
+from fastapi import HTTPException, status
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+
+from .cache import LRUCache
+from .metrics import REGISTRY
+
+QUEUE_WAIT = REGISTRY.histogram(
+    "claude_queue_wait_seconds", "Time Claude requests wait for a slot, by request class", ["request_class"]
+)
+REJECTIONS = REGISTRY.counter(
+    "claude_rejections_total", "Claude requests rejected before queueing", ["request_class", "reason"]
+)
+
+# Interactive chat gets a larger share of model capacity than search. Background
+# work (batched extraction) is never rate limited or rejected, only ordered.
+CLASS_WEIGHTS = {
+    "chat": float(os.getenv("CLAUDE_CHAT_WEIGHT", "4")),
+    "search": float(os.getenv("CLAUDE_SEARCH_WEIGHT", "1")),
+    "background": 1.0,
+}
+UNLIMITED_CLASSES = {"background"}
+
+class _Waiter:
+    __slots__ = ("finish", "seq", "request_class", "future", "enqueued_at")
+
+    def __init__(self, finish: float, seq: int, request_class: str, future: asyncio.Future):
+        self.finish = finish
+        self.seq = seq
+        self.request_class = request_class
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.finish, self.seq) < (other.finish, other.seq)
+
+# Admission control and ordering for Claude calls. Each user has a token bucket
+# that caps their request rate; requests beyond the global concurrency cap wait
+# in a weighted fair queue, where every (class, user) pair is one flow, so a
+# user flooding the queue only delays their own requests. Full queues and empty
+# buckets fail fast with 429 and a Retry-After hint instead of queueing forever.
+class ClaudeScheduler:
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        user_rate: float = 1.0,
+        user_burst: int = 10,
+        max_queue: int = 200,
+        max_user_queue: int = 5,
+        class_weights: Optional[Dict[str, float]] = None
+    ):
+        self.max_concurrency = max_concurrency
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_queue = max_queue
+        self.max_user_queue = max_user_queue
+        self.class_weights = class_weights or CLASS_WEIGHTS
+        # An idle bucket refills completely within burst / rate seconds, after
+        # which forgetting it is the same as keeping it. A rate of 0 turns
+        # per-user rate limiting off.
+        self._buckets = LRUCache(max_size=100000, ttl=user_burst / user_rate if user_rate > 0 else 0)
+        self._queue: List[_Waiter] = []
+        self._queued = 0
+        self._queued_by_user: Dict[str, int] = {}
+        self._flow_finish: Dict[Tuple[str, str], float] = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._in_flight = 0
+        # Smoothed model call duration, used for Retry-After estimates
+        self._service_time = 1.0
+        self.stats = {"admitted": 0, "rate_limited": 0, "queue_full": 0, "waited": 0}
+
+    def admit(self, user_id: Optional[str], request_class: str) -> None:
+        # Raises 429 if the request may not queue. Runs before any response is
+        # started, so streaming endpoints call it up front and pass admitted=True.
+        if request_class in UNLIMITED_CLASSES or user_id is None:
+            return
+        retry_after = self._take_token(user_id) if self.user_rate > 0 else 0.0
+        if retry_after:
+            self._reject(request_class, "rate_limited", retry_after)
+        if self._queue_length() >= self.max_queue or self._queued_by_user.get(user_id, 0) >= self.max_user_queue:
+            self._give_back_token(user_id)
+            self._reject(request_class, "queue_full", self._queue_retry_after())
+        self.stats["admitted"] += 1
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[str], request_class: str, admitted: bool = False) -> AsyncIterator[None]:
+        if not admitted:
+            self.admit(user_id, request_class)
+        await self._wait_turn(user_id or "", request_class)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._service_time = 0.9 * self._service_time + 0.1 * (time.perf_counter() - started)
+            self._release()
+
+    def get_stats(self) -> Dict[str, float]:
+        return dict(
+            self.stats,
+            queued=self._queue_length(),
+            in_flight=self._in_flight,
+            max_concurrency=self.max_concurrency,
+            service_time_seconds=self._service_time,
+        )
+
+    async def _wait_turn(self, user_id: str, request_class: str) -> None:
+        if self._in_flight < self.max_concurrency and not self._queue_length():
+            self._in_flight += 1
+            QUEUE_WAIT.observe(0.0, request_class=request_class)
+            return
+
+        # Self-clocked fair queueing: a flow's next request is tagged after both the
+        # current virtual time and its own previous request, and the lowest tag goes next
+        flow = (request_class, user_id)
+        start = max(self._virtual_time, self._flow_finish.get(flow, 0.0))
+        finish = start + 1.0 / self.class_weights.get(request_class, 1.0)
+        self._flow_finish[flow] = finish
+        waiter = _Waiter(finish, next(self._seq), request_class, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, waiter)
+        self._queued += 1
+        self._queued_by_user[user_id] = self._queued_by_user.get(user_id, 0) + 1
+        self.stats["waited"] += 1
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was handed over just as the caller went away
+                self._release()
+            raise
+        finally:
+            self._queued -= 1
+            self._queued_by_user[user_id] -= 1
+            if not self._queued_by_user[user_id]:
+                del self._queued_by_user[user_id]
+            QUEUE_WAIT.observe(time.perf_counter() - waiter.enqueued_at, request_class=request_class)
+
+    def _release(self) -> None:
+        while self._queue:
+            waiter = heapq.heappop(self._queue)
+            if waiter.future.done():
+                # Cancelled while waiting
+                continue
+            self._virtual_time = waiter.finish
+            waiter.future.set_result(None)
+            self._forget_idle_flows()
+            return
+        self._in_flight -= 1
+
+    def _forget_idle_flows(self) -> None:
+        # Flows whose last tag is behind the virtual clock start from it anyway
+        if len(self._flow_finish) > 4 * (len(self._queue) + self.max_concurrency):
+            self._flow_finish = {
+                flow: finish for flow, finish in self._flow_finish.items() if finish > self._virtual_time
+            }
+
+    def _queue_length(self) -> int:
+        return self._queued
+
+    def _take_token(self, user_id: str) -> float:
+        # Returns 0 when a token was taken, otherwise seconds until one is available
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(user_id) or (float(self.user_burst), now)
+        tokens = min(float(self.user_burst), tokens + (now - updated) * self.user_rate)
+        if tokens < 1.0:
+            self._buckets.set(user_id, (tokens, now))
+            return (1.0 - tokens) / self.user_rate
+        self._buckets.set(user_id, (tokens - 1.0, now))
+        return 0.0
+
+    def _give_back_token(self, user_id: str) -> None:
+        entry = self._buckets.get(user_id) if self.user_rate > 0 else None
+        if entry:
+            self._buckets.set(user_id, (min(float(self.user_burst), entry[0] + 1.0), entry[1]))
+
+    def _queue_retry_after(self) -> float:
+        return self._queue_length() * self._service_time / max(1, self.max_concurrency)
+
+    def _reject(self, request_class: str, reason: str, retry_after: float) -> None:
+        self.stats[reason] += 1
+        REJECTIONS.inc(request_class=request_class, reason=reason)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests to the assistant, please retry shortly",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+def create_claude_scheduler() -> ClaudeScheduler:
+    return ClaudeScheduler(
+        max_concurrency=int(os.getenv("CLAUDE_MAX_CONCURRENCY", "8")),
+        user_rate=float(os.getenv("CLAUDE_USER_RATE", "1.0")),
+        user_burst=int(os.getenv("CLAUDE_USER_BURST", "10")),
+        max_queue=int(os.getenv("CLAUDE_MAX_QUEUE", "200")),
+        max_user_queue=int(os.getenv("CLAUDE_USER_MAX_QUEUE", "5")),
+    )
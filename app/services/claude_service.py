@@ -1,10 +1,55 @@
 import anthropic
-from typing import Dict, List, Tuple
+from fastapi import HTTPException
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import json
+import random
 import os
+import time
+
+from .characteristic_parser import parse_characteristics, split_reply
+from .claude_scheduler import ClaudeScheduler, create_claude_scheduler
+from .conversation_memory import ConversationContext
+from .metrics import REGISTRY
+
+CLAUDE_LATENCY = REGISTRY.histogram(
+    "claude_request_seconds", "Claude API call latency including retries", ["operation", "outcome"]
+)
+CLAUDE_TOKENS = REGISTRY.counter("claude_tokens_total", "Tokens reported by the Claude API", ["direction"])
+
+BATCH_EXTRACTION_PROMPT = """Extract user characteristics from each message below. Reply with only a JSON object that maps every item id to an array of {{"key": ..., "value": ...}} objects, one per characteristic, using keys such as interest, profession, skill, language, city, trait, education or goal, and [] for messages without any.
+
+Messages:
+{items}"""
+
+RETRYABLE_ERRORS = (
+    anthropic.APIConnectionError,
+    anthropic.RateLimitError,
+    anthropic.InternalServerError,
+    asyncio.TimeoutError,
+)
 
 class ClaudeService:
-    def __init__(self):
-        self.client = anthropic.Client(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    def __init__(self, client=None, query_cache=None, scheduler: Optional[ClaudeScheduler] = None):
+        self.model = os.getenv("CLAUDE_MODEL", "claude-3-opus-20240229")
+        self.timeout = float(os.getenv("CLAUDE_TIMEOUT", "60"))
+        self.max_retries = int(os.getenv("CLAUDE_MAX_RETRIES", "3"))
+        self.retry_base_delay = float(os.getenv("CLAUDE_RETRY_BASE_DELAY", "0.5"))
+        # "structured" reads only the tagged JSON block; "lines" is the old colon-split parser
+        self.extraction_format = os.getenv("EXTRACTION_FORMAT", "structured")
+        # "reply" asks the chat call to list characteristics after its answer; "batched"
+        # leaves them to separate extraction requests, so chat calls carry no extraction work
+        self.extraction_mode = os.getenv("EXTRACTION_MODE", "reply")
+        self.client = client or self._create_client()
+        self.query_cache = query_cache
+        # Holds the global concurrency cap (CLAUDE_MAX_CONCURRENCY) and decides who goes next
+        self.scheduler = scheduler or create_claude_scheduler()
+        self.stats = {
+            "completed": 0,
+            "failed": 0,
+            "retries": 0,
+            "timeouts": 0,
+        }
         self.system_prompt = """You are a helpful AI assistant managing a chat platform. Your tasks include:
 1. Extracting user characteristics from conversations
 2. Helping users find other users based on characteristics
@@ -15,46 +60,231 @@ When extracting characteristics, focus on:
 - Interests and hobbies
 - Professional background
 - Personal traits
-- Skills and expertise"""
+- Skills and expertise
+
+After your reply, list the characteristics the user revealed about themselves inside
+<characteristics></characteristics> tags as a JSON array of objects with "key", "value"
+and "confidence" (0 to 1) fields, using keys such as interest, profession, skill,
+language, city, trait, education or goal. Use an empty array when there are none."""
+        self.chat_system_prompt = """You are a helpful AI assistant managing a chat platform. Your tasks include:
+1. Helping users find other users based on characteristics
+2. Facilitating communication between users
+3. Maintaining conversation context"""
+        # Search asks for the characteristics wanted in other users, not facts about the searcher
+        self.search_system_prompt = """You are a helpful AI assistant managing a chat platform. You turn a user's
+search for other users into the characteristics those users should have.
+
+List the characteristics the search asks for inside <characteristics></characteristics>
+tags as a JSON array of objects with "key" and "value" fields, using keys such as
+interest, profession, skill, language, city, trait, education or goal. Use an empty
+array when the search names none."""
 
-    async def process_message(self, user_id: str, message: str) -> Tuple[str, Dict[str, str]]:
+    @staticmethod
+    def _create_client():
+        if os.getenv("CLAUDE_BACKEND", "anthropic") == "stub":
+            from .claude_stub import StubClaudeClient
+            return StubClaudeClient(latency=float(os.getenv("CLAUDE_STUB_LATENCY", "0.5")))
+        # Retries are handled here so they share the concurrency limit and backoff policy
+        return anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0)
+
+    async def close(self):
+        await self.client.close()
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats, **self.scheduler.get_stats())
+
+    async def process_message(self, user_id: str, message: str, context: Optional[ConversationContext] = None) -> str:
+        # Characteristics are extracted from the reply later by the extraction pipeline
         try:
-            response = self.client.messages.create(
-                model="claude-3-opus-20240229",
-                max_tokens=1000,
-                system=self.system_prompt,
-                messages=[{
-                    "role": "user",
-                    "content": f"Process this message and extract any relevant user characteristics: {message}"
-                }]
+            return await self._create_message(
+                self._chat_content(message),
+                context,
+                user_id=user_id,
+                request_class="chat",
+                system=self._chat_system(context)
             )
-            
-            # Extract characteristics from Claude's analysis
-            characteristics = self._extract_characteristics(response.content)
-            
-            return response.content, characteristics
+        except HTTPException:
+            # Rejected by the scheduler; the caller gets the 429
+            raise
         except Exception as e:
             print(f"Error processing message: {e}")
-            return "I apologize, but I'm having trouble processing your message.", {}
+            return "I apologize, but I'm having trouble processing your message."
+
+    async def extract_characteristics(self, claude_response: str) -> List[Tuple[str, str]]:
+        if self.extraction_format == "lines":
+            return list(self._extract_characteristics(claude_response).items())
+        _, payload = split_reply(claude_response)
+        return parse_characteristics(payload) if payload is not None else []
+
+    def reply_text(self, claude_response: str) -> str:
+        # What the user sees: the reply without its characteristics block
+        if not self.reply_has_characteristics():
+            return claude_response
+        return split_reply(claude_response)[0]
+
+    def extracts_from_reply(self) -> bool:
+        return self.extraction_mode != "batched"
+
+    def reply_has_characteristics(self) -> bool:
+        # Whether chat replies end in a tagged block that must be kept from the user
+        return self.extracts_from_reply() and self.extraction_format != "lines"
+
+    async def extract_batch(self, items: List[Dict[str, str]]) -> Dict[str, List[Tuple[str, str]]]:
+        # One request covers many users' messages; results come back keyed by item id
+        response = await self._create_message(
+            BATCH_EXTRACTION_PROMPT.format(items=json.dumps(items)), request_class="background",
+            system=self.chat_system_prompt
+        )
+        start, end = response.find("{"), response.rfind("}")
+        if start == -1 or end < start:
+            raise ValueError("Batch extraction reply contained no JSON object")
+        parsed = json.loads(response[start:end + 1])
+        return {item["id"]: parse_characteristics(parsed.get(item["id"]) or []) for item in items}
+
+    async def stream_message(
+        self,
+        user_id: str,
+        message: str,
+        context: Optional[ConversationContext] = None,
+        admitted: bool = False
+    ) -> AsyncIterator[str]:
+        # Tokens are forwarded as they arrive, so there is no retry once output has started.
+        # Callers admit the request first, while a 429 can still be returned.
+        emitted = False
+        async with self.scheduler.slot(user_id, "chat", admitted=admitted):
+            started = time.perf_counter()
+            try:
+                async with self.client.messages.stream(
+                    model=self.model,
+                    max_tokens=1000,
+                    system=self._chat_system(context),
+                    messages=self._messages(self._chat_content(message), context)
+                ) as stream:
+                    async for text in stream.text_stream:
+                        emitted = True
+                        yield text
+                    self._record_usage(await stream.get_final_message())
+                self.stats["completed"] += 1
+                CLAUDE_LATENCY.observe(time.perf_counter() - started, operation="stream", outcome="ok")
+            except Exception as e:
+                self.stats["failed"] += 1
+                CLAUDE_LATENCY.observe(time.perf_counter() - started, operation="stream", outcome="error")
+                print(f"Error streaming message: {e}")
+                if not emitted:
+                    yield "I apologize, but I'm having trouble processing your message."
+
+    async def find_matching_users(self, query: str, user_id: Optional[str] = None) -> Dict[str, str]:
+        if self.query_cache:
+            cached = self.query_cache.get(query)
+            if cached is not None:
+                return cached
 
-    async def find_matching_users(self, query: str) -> Dict[str, str]:
         try:
-            response = self.client.messages.create(
-                model="claude-3-opus-20240229",
-                max_tokens=1000,
-                system=self.system_prompt,
-                messages=[{
-                    "role": "user",
-                    "content": f"Convert this user search query into characteristics: {query}"
-                }]
+            response = await self._create_message(
+                f"Convert this user search query into characteristics: {query}",
+                user_id=user_id,
+                request_class="search",
+                system=self.search_system_prompt
             )
-            
-            # Convert Claude's response into search criteria
-            return self._extract_characteristics(response.content)
+
+            # Convert Claude's response into search criteria, falling back to
+            # "key: value" lines when the reply has no characteristics block.
+            # Criteria carry no confidence, so none are dropped for it
+            _, payload = split_reply(response)
+            if payload is not None and self.extraction_format != "lines":
+                criteria = {}
+                for key, value in parse_characteristics(payload, min_confidence=0):
+                    # Several wanted values for one key are all kept as search tokens
+                    criteria[key] = f"{criteria[key]}, {value}" if key in criteria else value
+            else:
+                criteria = self._extract_characteristics(response)
+            # An empty result may be a bad reply; caching it would pin the query to no matches
+            if self.query_cache and criteria:
+                self.query_cache.set(query, criteria)
+            return criteria
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"Error finding matching users: {e}")
             return {}
 
+    def _system(self, context: Optional[ConversationContext], prompt: Optional[str] = None) -> str:
+        prompt = prompt or self.system_prompt
+        if context and context.summary:
+            return f"{prompt}\n\nSummary of the earlier conversation with this user:\n{context.summary}"
+        return prompt
+
+    def _chat_system(self, context: Optional[ConversationContext]) -> str:
+        return self._system(context, self.system_prompt if self.extracts_from_reply() else self.chat_system_prompt)
+
+    def _chat_content(self, message: str) -> str:
+        if self.extracts_from_reply():
+            return f"Process this message and extract any relevant user characteristics: {message}"
+        return message
+
+    @staticmethod
+    def _messages(content: str, context: Optional[ConversationContext]) -> List[Dict[str, str]]:
+        history = list(context.turns) if context else []
+        return history + [{"role": "user", "content": content}]
+
+    async def _create_message(
+        self,
+        content: str,
+        context: Optional[ConversationContext] = None,
+        user_id: Optional[str] = None,
+        request_class: str = "background",
+        system: Optional[str] = None
+    ) -> str:
+        async with self.scheduler.slot(user_id, request_class):
+            started = time.perf_counter()
+            try:
+                response = await self._create_with_retry(system or self._system(context), self._messages(content, context))
+                self.stats["completed"] += 1
+                CLAUDE_LATENCY.observe(time.perf_counter() - started, operation="create", outcome="ok")
+                self._record_usage(response)
+                return self._response_text(response)
+            except Exception:
+                self.stats["failed"] += 1
+                CLAUDE_LATENCY.observe(time.perf_counter() - started, operation="create", outcome="error")
+                raise
+
+    @staticmethod
+    def _record_usage(response) -> None:
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            CLAUDE_TOKENS.inc(usage.input_tokens, direction="input")
+            CLAUDE_TOKENS.inc(usage.output_tokens, direction="output")
+
+    async def _create_with_retry(self, system: str, messages: List[Dict[str, str]]):
+        attempt = 0
+        while True:
+            try:
+                return await asyncio.wait_for(
+                    self.client.messages.create(
+                        model=self.model,
+                        max_tokens=1000,
+                        system=system,
+                        messages=messages
+                    ),
+                    timeout=self.timeout
+                )
+            except RETRYABLE_ERRORS as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.stats["timeouts"] += 1
+                if attempt >= self.max_retries:
+                    raise
+                # Full jitter keeps retrying callers from stampeding the API together
+                delay = random.uniform(0, self.retry_base_delay * (2 ** attempt))
+                attempt += 1
+                self.stats["retries"] += 1
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _response_text(response) -> str:
+        if isinstance(response.content, str):
+            return response.content
+        return "".join(block.text for block in response.content if getattr(block, "type", "text") == "text")
+
     def _extract_characteristics(self, claude_response: str) -> Dict[str, str]:
         characteristics = {}
         try:
@@ -69,5 +299,5 @@ When extracting characteristics, focus on:
                         characteristics[key] = value
         except Exception as e:
             print(f"Error extracting characteristics: {e}")
-        
-        return characteristics
\ No newline at end of file
+
+        return characteristics
@@ -0,0 +1,122 @@
+from dataclasses import dataclass, field
+from sqlalchemy.orm import Session
+from typing import Dict, List
+import os
+import re
+
+from ..models.database import ConversationSummary, ConversationTurn, DBSession, run_in_session
+from .characteristic_parser import parse_characteristics, split_reply
+
+# Prompt budget for conversation history: the running summary gets up to
+# CONVERSATION_SUMMARY_TOKENS of it and recent turns share the rest
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", "2000"))
+CONVERSATION_SUMMARY_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", "400"))
+CONVERSATION_MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "20"))
+
+SUMMARY_LINE_CHARS = 160
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text; close enough for budgeting
+    return max(1, len(text) // 4)
+
+@dataclass(frozen=True)
+class ConversationContext:
+    summary: str = ""
+    turns: List[Dict[str, str]] = field(default_factory=list)
+
+    def tokens(self) -> int:
+        return (estimate_tokens(self.summary) if self.summary else 0) + sum(
+            estimate_tokens(turn["content"]) for turn in self.turns
+        )
+
+def summarize_turn(role: str, content: str) -> str:
+    if role == "assistant":
+        # Replies are mostly pleasantries around the characteristics worth remembering
+        content, payload = split_reply(content)
+        facts = [f"{key}: {value}" for key, value in parse_characteristics(payload or "").items()]
+        if facts:
+            return ("Assistant noted: " + "; ".join(facts))[:SUMMARY_LINE_CHARS]
+    first_sentence = re.split(r"(?<=[.!?])\s+|\n", content.strip(), maxsplit=1)[0]
+    return f"{'User' if role == 'user' else 'Assistant'}: {first_sentence}"[:SUMMARY_LINE_CHARS]
+
+def compact_summary(summary: str, turns: List[ConversationTurn], max_tokens: int) -> str:
+    # Extractive rather than model-written, so compaction never costs an extra Claude call
+    lines = summary.splitlines() if summary else []
+    for turn in turns:
+        line = summarize_turn(turn.role, turn.content)
+        if line not in lines:
+            lines.append(line)
+    # The oldest points are dropped first once the summary outgrows its share of the budget
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+class ConversationMemoryService:
+    def __init__(
+        self,
+        db: DBSession,
+        token_budget: int = CONVERSATION_TOKEN_BUDGET,
+        summary_tokens: int = CONVERSATION_SUMMARY_TOKENS,
+        max_turns: int = CONVERSATION_MAX_TURNS
+    ):
+        self.db = db
+        self.token_budget = token_budget
+        self.summary_tokens = min(summary_tokens, token_budget // 2)
+        self.max_turns = max_turns
+
+    @run_in_session
+    def get_context(self, db: Session, user_id: int) -> ConversationContext:
+        summary = db.get(ConversationSummary, user_id)
+        turns = db.query(ConversationTurn).filter(
+            ConversationTurn.user_id == user_id
+        ).order_by(ConversationTurn.id).all()
+        return ConversationContext(
+            summary=summary.summary if summary else "",
+            turns=[{"role": turn.role, "content": turn.content} for turn in turns]
+        )
+
+    @run_in_session
+    def record_exchange(self, db: Session, user_id: int, message: str, reply: str) -> None:
+        db.add_all([
+            ConversationTurn(user_id=user_id, role="user", content=message, tokens=estimate_tokens(message)),
+            ConversationTurn(user_id=user_id, role="assistant", content=reply, tokens=estimate_tokens(reply)),
+        ])
+        db.flush()
+        self._compact(db, user_id)
+        db.commit()
+
+    @run_in_session
+    def clear(self, db: Session, user_id: int) -> None:
+        db.query(ConversationTurn).filter(ConversationTurn.user_id == user_id).delete()
+        db.query(ConversationSummary).filter(ConversationSummary.user_id == user_id).delete()
+        db.commit()
+
+    def _compact(self, db: Session, user_id: int) -> None:
+        turns = db.query(ConversationTurn).filter(
+            ConversationTurn.user_id == user_id
+        ).order_by(ConversationTurn.id).all()
+        window_budget = self.token_budget - self.summary_tokens
+        total = sum(turn.tokens for turn in turns)
+
+        # Fold the oldest turns into the summary until the window fits. The latest
+        # exchange is always kept, and the window must start with a user turn
+        folded = []
+        while len(turns) > 2 and (
+            total > window_budget or len(turns) > self.max_turns or turns[0].role != "user"
+        ):
+            turn = turns.pop(0)
+            total -= turn.tokens
+            folded.append(turn)
+        if not folded:
+            return
+
+        summary = db.get(ConversationSummary, user_id)
+        if summary is None:
+            summary = ConversationSummary(user_id=user_id, summary="", tokens=0)
+            db.add(summary)
+        summary.summary = compact_summary(summary.summary, folded, self.summary_tokens)
+        summary.tokens = estimate_tokens(summary.summary)
+        db.query(ConversationTurn).filter(
+            ConversationTurn.user_id == user_id,
+            ConversationTurn.id <= folded[-1].id
+        ).delete(synchronize_session=False)
@@ -0,0 +1,91 @@
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import time
+
+from .claude_service import ClaudeService
+
+# Collects extraction-only work from many users for a short window and sends it
+# as one Claude request, then hands each caller back its own result. Trades up
+# to `max_wait` seconds of extra latency for fewer calls under load.
+class ExtractionBatcher:
+    def __init__(self, claude_service: ClaudeService, max_batch: int = 20, max_wait: float = 0.05):
+        self.claude_service = claude_service
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending: List[Tuple[Dict[str, str], asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes = set()
+        self.stats = {
+            "requests": 0,
+            "items": 0,
+            "batches": 0,
+            "full_flushes": 0,
+            "timer_flushes": 0,
+            "failed_batches": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+        }
+
+    async def extract(self, item_id: str, message: str) -> List[Tuple[str, str]]:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(({"id": item_id, "message": message}, future, time.monotonic()))
+        self.stats["requests"] += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush("full_flushes")
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush, "timer_flushes")
+        return await future
+
+    def get_stats(self) -> Dict[str, float]:
+        batches = self.stats["batches"]
+        return dict(
+            self.stats,
+            max_batch=self.max_batch,
+            wait_window_seconds=self.max_wait,
+            pending=len(self._pending),
+            avg_batch_size=self.stats["items"] / batches if batches else 0.0,
+            fill_ratio=self.stats["items"] / (batches * self.max_batch) if batches else 0.0,
+            avg_wait_seconds=self.stats["total_wait_seconds"] / self.stats["items"] if self.stats["items"] else 0.0
+        )
+
+    async def close(self) -> None:
+        if self._pending:
+            self._flush("timer_flushes")
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def _flush(self, reason: str) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush, "timer_flushes")
+        if not batch:
+            return
+
+        now = time.monotonic()
+        waits = [now - enqueued_at for _, _, enqueued_at in batch]
+        self.stats[reason] += 1
+        self.stats["batches"] += 1
+        self.stats["items"] += len(batch)
+        self.stats["total_wait_seconds"] += sum(waits)
+        self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], max(waits))
+
+        task = asyncio.create_task(self._send(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _send(self, batch: List[Tuple[Dict[str, str], asyncio.Future, float]]) -> None:
+        try:
+            results = await self.claude_service.extract_batch([item for item, _, _ in batch])
+        except Exception as e:
+            # Every caller sees the failure and retries through its own pipeline job
+            self.stats["failed_batches"] += 1
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for item, future, _ in batch:
+            if not future.done():
+                future.set_result(results.get(item["id"], []))
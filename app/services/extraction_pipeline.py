@@ -0,0 +1,158 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+import asyncio
+import itertools
+import time
+
+from .cache import LRUCache
+
+_job_ids = itertools.count(1)
+
+@dataclass
+class ExtractionJob:
+    user_id: int
+    text: str
+    message: str = ""
+    job_id: int = field(default_factory=lambda: next(_job_ids))
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+    error: Optional[str] = None
+
+# Background pipeline that turns chat replies into stored characteristics.
+# Chat handlers only enqueue a job; workers extract, drop characteristics the
+# user already has, and persist the rest, retrying failures with backoff and
+# parking jobs that keep failing in a bounded dead-letter queue.
+class ExtractionPipeline:
+    def __init__(
+        self,
+        extract: Callable[[ExtractionJob], Awaitable[List[Tuple[str, str]]]],
+        persist: Callable[[int, List[Tuple[str, str]]], None],
+        load_known: Callable[[int], Awaitable[Dict[str, str]]],
+        max_queue: int = 1000,
+        workers: int = 2,
+        max_retries: int = 3,
+        retry_delay: float = 0.5,
+        dead_letter_size: int = 100,
+        known_cache_size: int = 10000
+    ):
+        self.extract = extract
+        self.persist = persist
+        self.load_known = load_known
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.dead_letters: Deque[ExtractionJob] = deque(maxlen=dead_letter_size)
+        self.known = LRUCache(max_size=known_cache_size, ttl=3600)
+        self._tasks: List[asyncio.Task] = []
+        self._retries: Set[asyncio.Task] = set()
+        self.stats = {
+            "submitted": 0,
+            "rejected": 0,
+            "processed": 0,
+            "retried": 0,
+            "dead_lettered": 0,
+            "persisted": 0,
+            "deduplicated": 0,
+            "last_lag_seconds": 0.0,
+            "max_lag_seconds": 0.0,
+        }
+
+    def submit(self, user_id: int, text: str, message: str = "") -> bool:
+        job = ExtractionJob(user_id=user_id, text=text, message=message)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            self._dead_letter(job, "queue full")
+            return False
+        self.stats["submitted"] += 1
+        return True
+
+    def get_stats(self) -> Dict[str, float]:
+        oldest_lag = 0.0
+        if self.queue.qsize():
+            # asyncio.Queue keeps items in a deque; the head is the oldest job
+            oldest_lag = time.monotonic() - self.queue._queue[0].enqueued_at
+        return dict(
+            self.stats,
+            queued=self.queue.qsize(),
+            oldest_lag_seconds=oldest_lag,
+            dead_letter_size=len(self.dead_letters),
+            workers=self.workers
+        )
+
+    async def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        # Give queued jobs a chance to finish before cancelling the workers
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"Stopping extraction pipeline with {self.queue.qsize()} jobs still queued")
+        for task in self._tasks + list(self._retries):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._retries, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self.queue.get()
+            lag = time.monotonic() - job.enqueued_at
+            self.stats["last_lag_seconds"] = lag
+            self.stats["max_lag_seconds"] = max(self.stats["max_lag_seconds"], lag)
+            try:
+                await self._process(job)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self._retry_or_dead_letter(job, e)
+            finally:
+                self.queue.task_done()
+
+    async def _process(self, job: ExtractionJob) -> None:
+        characteristics = await self.extract(job)
+        if not characteristics:
+            return
+
+        known = await self._known_pairs(job.user_id)
+        new = [pair for pair in characteristics if pair not in known]
+        self.stats["deduplicated"] += len(characteristics) - len(new)
+        if not new:
+            return
+
+        self.persist(job.user_id, new)
+        known.update(new)
+        self.stats["persisted"] += len(new)
+
+    async def _known_pairs(self, user_id: int) -> Set[Tuple[str, str]]:
+        known = self.known.get(user_id)
+        if known is None:
+            known = set((await self.load_known(user_id)).items())
+            self.known.set(user_id, known)
+        return known
+
+    def _retry_or_dead_letter(self, job: ExtractionJob, error: Exception) -> None:
+        job.attempts += 1
+        job.error = str(error)
+        if job.attempts > self.max_retries:
+            print(f"Extraction job for user {job.user_id} failed permanently: {error}")
+            self._dead_letter(job, str(error))
+            return
+        self.stats["retried"] += 1
+        task = asyncio.create_task(self._requeue(job, self.retry_delay * (2 ** (job.attempts - 1))))
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+    async def _requeue(self, job: ExtractionJob, delay: float) -> None:
+        await asyncio.sleep(delay)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._dead_letter(job, "queue full on retry")
+
+    def _dead_letter(self, job: ExtractionJob, reason: str) -> None:
+        job.error = reason
+        self.dead_letters.append(job)
+        self.stats["dead_lettered"] += 1
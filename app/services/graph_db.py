@@ -1,19 +1,94 @@
-from neo4j import GraphDatabase
-from typing import List, Dict
+from neo4j import GraphDatabase, Driver
+from typing import List, Dict, Optional, Tuple
+import functools
 import os
+import time
+
+from .metrics import REGISTRY
+from .request_metrics import count_graph_session
+from .vocabulary import canonical_key, search_criteria, value_tokens
+
+GRAPH_LATENCY = REGISTRY.histogram(
+    "graph_operation_seconds", "Latency of graph service operations", ["backend", "operation"]
+)
+GRAPH_ERRORS = REGISTRY.counter(
+    "graph_operation_errors_total", "Graph service operations that raised", ["backend", "operation"]
+)
+
+def instrumented(method):
+    # Records latency and errors for a graph service method under its own name
+    operation = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        except Exception:
+            GRAPH_ERRORS.inc(backend=self.backend, operation=operation)
+            raise
+        finally:
+            GRAPH_LATENCY.observe(time.perf_counter() - started, backend=self.backend, operation=operation)
+    return wrapper
+
+def create_driver() -> Driver:
+    return GraphDatabase.driver(
+        os.getenv("NEO4J_URI"),
+        auth=(os.getenv("NEO4J_USER"), os.getenv("NEO4J_PASSWORD")),
+        max_connection_pool_size=int(os.getenv("NEO4J_MAX_POOL_SIZE", "50")),
+        connection_acquisition_timeout=float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", "30")),
+        # Pooled connections are recycled before servers or load balancers drop them
+        max_connection_lifetime=float(os.getenv("NEO4J_MAX_CONNECTION_LIFETIME", "3600")),
+    )
+
+def create_graph_service():
+    if os.getenv("GRAPH_BACKEND", "neo4j") == "memory":
+        from .graph_memory import InMemoryGraphService
+        return InMemoryGraphService()
+    return GraphService()
 
 class GraphService:
-    def __init__(self):
-        self.uri = os.getenv("NEO4J_URI")
-        self.user = os.getenv("NEO4J_USER")
-        self.password = os.getenv("NEO4J_PASSWORD")
-        self.driver = GraphDatabase.driver(self.uri, auth=(self.user, self.password))
+    backend = "neo4j"
+
+    def __init__(self, driver: Optional[Driver] = None):
+        # The driver is normally opened by the application lifespan via connect()
+        self.driver = driver
+
+    def connect(self) -> None:
+        if self.driver is None:
+            self.driver = create_driver()
+
+    def _session(self):
+        count_graph_session()
+        return self.driver.session()
+
+    def check_connectivity(self) -> bool:
+        # Liveness check: opens a connection and runs a round-trip to the server
+        try:
+            self.driver.verify_connectivity()
+            return True
+        except Exception as e:
+            GRAPH_ERRORS.inc(backend=self.backend, operation="check_connectivity")
+            print(f"Neo4j is not reachable: {e}")
+            return False
 
     def close(self):
-        self.driver.close()
+        if self.driver is not None:
+            self.driver.close()
+            self.driver = None
+
+    @instrumented
+    def create_schema(self):
+        with self._session() as session:
+            session.run("CREATE CONSTRAINT user_username IF NOT EXISTS FOR (u:User) REQUIRE u.username IS UNIQUE")
+            session.run("CREATE CONSTRAINT characteristic_name_value IF NOT EXISTS FOR (c:Characteristic) REQUIRE (c.name, c.value) IS UNIQUE")
+            session.run("CREATE INDEX characteristic_key IF NOT EXISTS FOR (c:Characteristic) ON (c.key)")
+            # Ranked search seeks (key, token) pairs here and follows HAS_TOKEN back to characteristics
+            session.run("CREATE CONSTRAINT token_key_value IF NOT EXISTS FOR (t:Token) REQUIRE (t.key, t.value) IS UNIQUE")
 
+    @instrumented
     def add_user_characteristic(self, username: str, characteristic: str, value: str):
-        with self.driver.session() as session:
+        with self._session() as session:
             session.execute_write(self._create_user_characteristic,
                                 username, characteristic, value)
 
@@ -26,8 +101,39 @@ class GraphService:
         )
         tx.run(query, username=username, characteristic=characteristic, value=value)
 
+    @instrumented
+    def add_user_characteristics(self, username: str, characteristics: Dict[str, str]):
+        self.add_characteristics_batch([
+            {"username": username, "name": char, "value": value}
+            for char, value in characteristics.items()
+        ])
+
+    @instrumented
+    def add_characteristics_batch(self, rows: List[Dict[str, str]]):
+        if not rows:
+            return
+        # Canonical key on the node and one Token node per value token, for ranked search
+        rows = [dict(row, key=canonical_key(row["name"]), tokens=value_tokens(row["value"])) for row in rows]
+        with self._session() as session:
+            session.execute_write(self._create_user_characteristics, rows)
+
+    @staticmethod
+    def _create_user_characteristics(tx, rows: List[Dict]):
+        query = (
+            "UNWIND $rows AS row "
+            "MERGE (u:User {username: row.username}) "
+            "MERGE (c:Characteristic {name: row.name, value: row.value}) "
+            "SET c.key = row.key "
+            "MERGE (u)-[:HAS]->(c) "
+            "FOREACH (token IN row.tokens | "
+            "MERGE (t:Token {key: row.key, value: token}) "
+            "MERGE (c)-[:HAS_TOKEN]->(t))"
+        )
+        tx.run(query, rows=rows)
+
+    @instrumented
     def find_users_by_characteristics(self, characteristics: Dict[str, str]) -> List[str]:
-        with self.driver.session() as session:
+        with self._session() as session:
             return session.execute_read(self._find_users, characteristics)
 
     @staticmethod
@@ -47,8 +153,78 @@ class GraphService:
         result = tx.run(query, **params)
         return [record["username"] for record in result]
 
+    @instrumented
+    def search_users_ranked(
+        self,
+        characteristics: Dict[str, str],
+        limit: int = 20,
+        weights: Dict[str, float] = None
+    ) -> List[Tuple[str, float]]:
+        criteria = search_criteria(characteristics, weights)
+        if not criteria:
+            return []
+        with self._session() as session:
+            return session.execute_read(self._search_users_ranked, criteria, limit)
+
+    @staticmethod
+    def _search_users_ranked(tx, criteria: List[Dict], limit: int) -> List[Tuple[str, float]]:
+        # Each criterion token is an index seek on (:Token {key, value}); only the
+        # characteristics linked to those tokens are visited, and the number of
+        # distinct tokens reached is the overlap. A user's score is the weighted
+        # sum of their best match per criterion, so partial matches still rank
+        # instead of failing an all-or-nothing AND.
+        query = (
+            "UNWIND $criteria AS criterion "
+            "UNWIND criterion.tokens AS token "
+            "MATCH (t:Token {key: criterion.key, value: token})<-[:HAS_TOKEN]-(c:Characteristic) "
+            "WITH criterion, c, count(DISTINCT t) AS shared "
+            "MATCH (u:User)-[:HAS]->(c) "
+            "WITH u, criterion, max(toFloat(shared) / size(criterion.tokens)) AS overlap "
+            "WITH u, sum(criterion.weight * overlap) AS score, count(criterion) AS matched "
+            "RETURN u.username as username, score "
+            "ORDER BY score DESC, matched DESC, username "
+            "LIMIT $limit"
+        )
+        result = tx.run(query, criteria=criteria, limit=limit)
+        return [(record["username"], record["score"]) for record in result]
+
+    @instrumented
+    def backfill_vocabulary(self, batch_size: int = 1000) -> int:
+        # Characteristic nodes written before the vocabulary existed get a key and Token links
+        updated = 0
+        with self._session() as session:
+            while True:
+                rows = session.execute_read(self._characteristics_without_key, batch_size)
+                if not rows:
+                    return updated
+                rows = [dict(row, key=canonical_key(row["name"]), tokens=value_tokens(row["value"])) for row in rows]
+                session.execute_write(self._set_vocabulary, rows)
+                updated += len(rows)
+
+    @staticmethod
+    def _characteristics_without_key(tx, batch_size: int) -> List[Dict[str, str]]:
+        query = (
+            "MATCH (c:Characteristic) WHERE c.key IS NULL "
+            "RETURN c.name as name, c.value as value LIMIT $batch_size"
+        )
+        result = tx.run(query, batch_size=batch_size)
+        return [{"name": record["name"], "value": record["value"]} for record in result]
+
+    @staticmethod
+    def _set_vocabulary(tx, rows: List[Dict]):
+        query = (
+            "UNWIND $rows AS row "
+            "MATCH (c:Characteristic {name: row.name, value: row.value}) "
+            "SET c.key = row.key "
+            "FOREACH (token IN row.tokens | "
+            "MERGE (t:Token {key: row.key, value: token}) "
+            "MERGE (c)-[:HAS_TOKEN]->(t))"
+        )
+        tx.run(query, rows=rows)
+
+    @instrumented
     def get_user_characteristics(self, username: str) -> Dict[str, str]:
-        with self.driver.session() as session:
+        with self._session() as session:
             return session.execute_read(self._get_characteristics, username)
 
     @staticmethod
@@ -60,8 +236,40 @@ class GraphService:
         result = tx.run(query, username=username)
         return {record["name"]: record["value"] for record in result}
 
+    @instrumented
+    def get_users_characteristics(self, usernames: List[str]) -> Dict[str, Dict[str, str]]:
+        if not usernames:
+            return {}
+        with self._session() as session:
+            return session.execute_read(self._get_users_characteristics, usernames)
+
+    @staticmethod
+    def _get_users_characteristics(tx, usernames: List[str]) -> Dict[str, Dict[str, str]]:
+        query = (
+            "UNWIND $usernames AS username "
+            "MATCH (u:User {username: username})-[:HAS]->(c:Characteristic) "
+            "RETURN u.username as username, collect([c.name, c.value]) as characteristics"
+        )
+        result = tx.run(query, usernames=usernames)
+        return {record["username"]: dict(record["characteristics"]) for record in result}
+
+    @instrumented
+    def get_all_user_characteristics(self) -> List[Tuple[str, str, str]]:
+        with self._session() as session:
+            return session.execute_read(self._get_all_user_characteristics)
+
+    @staticmethod
+    def _get_all_user_characteristics(tx) -> List[Tuple[str, str, str]]:
+        query = (
+            "MATCH (u:User)-[:HAS]->(c:Characteristic) "
+            "RETURN u.username as username, c.name as name, c.value as value"
+        )
+        result = tx.run(query)
+        return [(record["username"], record["name"], record["value"]) for record in result]
+
+    @instrumented
     def find_similar_users(self, username: str, limit: int = 5) -> List[str]:
-        with self.driver.session() as session:
+        with self._session() as session:
             return session.execute_read(self._find_similar_users, username, limit)
 
     @staticmethod
@@ -0,0 +1,125 @@
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+import threading
+
+from .graph_db import instrumented
+from .vocabulary import canonical_key, search_criteria, value_tokens
+
+Characteristic = Tuple[str, str]
+
+# In-process stand-in for GraphService with the same methods and result
+# ordering, so the app, tests and benchmarks can run without a live Neo4j.
+# Selected with GRAPH_BACKEND=memory; nothing is persisted across restarts.
+class InMemoryGraphService:
+    backend = "memory"
+
+    def __init__(self):
+        self.users: Dict[str, Set[Characteristic]] = {}
+        self.holders: Dict[Characteristic, Set[str]] = defaultdict(set)
+        # (canonical key, value token) -> characteristics, like the Token nodes in Neo4j
+        self.tokens: Dict[Tuple[str, str], Set[Characteristic]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def connect(self) -> None:
+        pass
+
+    def check_connectivity(self) -> bool:
+        return True
+
+    def close(self):
+        pass
+
+    @instrumented
+    def create_schema(self):
+        pass
+
+    @instrumented
+    def add_user_characteristic(self, username: str, characteristic: str, value: str):
+        self.add_characteristics_batch([{"username": username, "name": characteristic, "value": value}])
+
+    @instrumented
+    def add_user_characteristics(self, username: str, characteristics: Dict[str, str]):
+        self.add_characteristics_batch([
+            {"username": username, "name": char, "value": value}
+            for char, value in characteristics.items()
+        ])
+
+    @instrumented
+    def add_characteristics_batch(self, rows: List[Dict[str, str]]):
+        with self._lock:
+            for row in rows:
+                characteristic = (row["name"], row["value"])
+                self.users.setdefault(row["username"], set()).add(characteristic)
+                self.holders[characteristic].add(row["username"])
+                key = canonical_key(row["name"])
+                for token in value_tokens(row["value"]):
+                    self.tokens[(key, token)].add(characteristic)
+
+    @instrumented
+    def find_users_by_characteristics(self, characteristics: Dict[str, str]) -> List[str]:
+        wanted = set(characteristics.items())
+        with self._lock:
+            return [username for username, owned in self.users.items() if wanted <= owned]
+
+    @instrumented
+    def search_users_ranked(
+        self,
+        characteristics: Dict[str, str],
+        limit: int = 20,
+        weights: Dict[str, float] = None
+    ) -> List[Tuple[str, float]]:
+        # Same scoring as the Cypher query: per criterion, a user's best token
+        # overlap times the criterion weight, summed across criteria. Only
+        # characteristics sharing a token with the criterion are visited.
+        criteria = search_criteria(characteristics, weights)
+        scores: Dict[str, float] = defaultdict(float)
+        matched: Dict[str, int] = defaultdict(int)
+        with self._lock:
+            for criterion in criteria:
+                shared: Dict[Characteristic, int] = defaultdict(int)
+                for token in criterion["tokens"]:
+                    for characteristic in self.tokens.get((criterion["key"], token), ()):
+                        shared[characteristic] += 1
+                best: Dict[str, float] = {}
+                for characteristic, overlap in shared.items():
+                    for username in self.holders[characteristic]:
+                        best[username] = max(best.get(username, 0.0), overlap / len(criterion["tokens"]))
+                for username, overlap in best.items():
+                    scores[username] += criterion["weight"] * overlap
+                    matched[username] += 1
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -matched[item[0]], item[0]))
+        return ranked[:limit]
+
+    @instrumented
+    def backfill_vocabulary(self, batch_size: int = 1000) -> int:
+        # Vocabulary is computed on every write here, so nothing is ever missing
+        return 0
+
+    @instrumented
+    def get_user_characteristics(self, username: str) -> Dict[str, str]:
+        with self._lock:
+            return dict(self.users.get(username, ()))
+
+    @instrumented
+    def get_users_characteristics(self, usernames: List[str]) -> Dict[str, Dict[str, str]]:
+        with self._lock:
+            return {username: dict(self.users[username]) for username in usernames if self.users.get(username)}
+
+    @instrumented
+    def get_all_user_characteristics(self) -> List[Tuple[str, str, str]]:
+        with self._lock:
+            return [
+                (username, name, value)
+                for username, owned in self.users.items()
+                for name, value in owned
+            ]
+
+    @instrumented
+    def find_similar_users(self, username: str, limit: int = 5) -> List[str]:
+        common: Dict[str, int] = defaultdict(int)
+        with self._lock:
+            for characteristic in self.users.get(username, ()):
+                for other in self.holders[characteristic]:
+                    if other != username:
+                        common[other] += 1
+        return [other for other, _ in sorted(common.items(), key=lambda item: (-item[1], item[0]))[:limit]]
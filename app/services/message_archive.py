@@ -0,0 +1,312 @@
+from datetime import datetime, timedelta
+from sqlalchemy import case, func, or_
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import math
+import mmap
+import os
+import time
+import zlib
+
+from ..models.database import ArchiveBlock, ArchiveDeletion, Message
+from .cache import LRUCache
+
+MESSAGE_ARCHIVE_DIR = os.getenv("MESSAGE_ARCHIVE_DIR", "./message_archive")
+MESSAGE_ARCHIVE_AFTER_DAYS = float(os.getenv("MESSAGE_ARCHIVE_AFTER_DAYS", "90"))
+MESSAGE_ARCHIVE_BLOCK_MESSAGES = int(os.getenv("MESSAGE_ARCHIVE_BLOCK_MESSAGES", "200"))
+
+Row = Tuple[int, int, int, str, str]
+
+# Cold storage for old messages. Each conversation has an append-only segment
+# file of zlib-compressed blocks, each block a JSON list of messages in id
+# order. The block index lives in SQLite (ArchiveBlock), so moving messages out
+# of the hot table and recording where they went commit in one transaction.
+# Segment bytes are written and synced before that commit; a crash in between
+# leaves only unreferenced bytes that the next compaction drops.
+class MessageArchive:
+    def __init__(
+        self,
+        root: str = MESSAGE_ARCHIVE_DIR,
+        block_messages: int = MESSAGE_ARCHIVE_BLOCK_MESSAGES,
+        cache_size: int = 256
+    ):
+        self.root = root
+        self.block_messages = block_messages
+        # Recently decoded blocks, since paging back through a conversation reads the same block repeatedly.
+        # Keyed by location rather than ArchiveBlock.id: segment bytes are never rewritten in place,
+        # while a row id can come back for a different block after compaction.
+        self._blocks = LRUCache(max_size=cache_size, ttl=3600)
+        self._maps = LRUCache(max_size=cache_size, ttl=3600)
+        self.stats = {"block_reads": 0, "archived": 0, "compacted_conversations": 0}
+
+    # Reads
+
+    def read_before(self, db: Session, user1_id: int, user2_id: int, before: Optional[int], limit: int) -> List[Message]:
+        # Newest first, ids below `before`
+        query = self._conversation_blocks(db, user1_id, user2_id)
+        if before is not None:
+            query = query.filter(ArchiveBlock.first_id < before)
+        blocks = query.order_by(ArchiveBlock.last_id.desc()).all()
+
+        rows: List[Row] = []
+        for position, block in enumerate(blocks):
+            rows.extend(row for row in self._read_block(db, block) if before is None or row[0] < before)
+            rows.sort(key=lambda row: row[0], reverse=True)
+            following = blocks[position + 1] if position + 1 < len(blocks) else None
+            if following is None or (len(rows) >= limit and following.last_id < rows[limit - 1][0]):
+                break
+        return [self._to_message(row) for row in rows[:limit]]
+
+    def read_after(self, db: Session, user1_id: int, user2_id: int, after: int, limit: int) -> List[Message]:
+        # Oldest first, ids above `after`
+        blocks = self._conversation_blocks(db, user1_id, user2_id).filter(
+            ArchiveBlock.last_id > after
+        ).order_by(ArchiveBlock.first_id.asc()).all()
+
+        rows: List[Row] = []
+        for position, block in enumerate(blocks):
+            rows.extend(row for row in self._read_block(db, block) if row[0] > after)
+            rows.sort(key=lambda row: row[0])
+            following = blocks[position + 1] if position + 1 < len(blocks) else None
+            if following is None or (len(rows) >= limit and following.first_id > rows[limit - 1][0]):
+                break
+        return [self._to_message(row) for row in rows[:limit]]
+
+    def newest_id(self, db: Session, user1_id: int, user2_id: int, before: Optional[int] = None) -> Optional[int]:
+        # Upper bound on archived ids below `before`, from the index alone
+        query = db.query(func.max(ArchiveBlock.last_id)).filter(*self._conversation_filter(user1_id, user2_id))
+        if before is not None:
+            query = query.filter(ArchiveBlock.first_id < before)
+        return query.scalar()
+
+    def has_after(self, db: Session, user1_id: int, user2_id: int, after: int) -> bool:
+        return db.query(ArchiveBlock.id).filter(
+            *self._conversation_filter(user1_id, user2_id), ArchiveBlock.last_id > after
+        ).first() is not None
+
+    def delete(self, db: Session, message_id: int, user_id: int) -> bool:
+        # The message stays in its block until compaction; a tombstone hides it meanwhile
+        blocks = db.query(ArchiveBlock).filter(
+            ArchiveBlock.last_id >= message_id,
+            ArchiveBlock.first_id <= message_id,
+            or_(ArchiveBlock.user_lo == user_id, ArchiveBlock.user_hi == user_id)
+        ).all()
+        for block in blocks:
+            if any(row[0] == message_id for row in self._read_block(db, block)):
+                db.add(ArchiveDeletion(message_id=message_id, block_id=block.id))
+                db.commit()
+                return True
+        return False
+
+    # Archiving
+
+    def archive_older_than(self, db: Session, cutoff: datetime, batch_size: int = 10000) -> int:
+        # Only read messages are archived, and each conversation keeps its newest
+        # message hot, so unread counts and the conversation list never need the archive
+        # CASE instead of two-argument min()/max(), which only SQLite accepts as scalars
+        sender_first = Message.sender_id < Message.recipient_id
+        user_lo = case((sender_first, Message.sender_id), else_=Message.recipient_id)
+        user_hi = case((sender_first, Message.recipient_id), else_=Message.sender_id)
+        conversations = db.query(user_lo, user_hi).filter(
+            Message.timestamp < cutoff, Message.read == True
+        ).distinct().all()
+
+        # Conversation by conversation, so each run appends full blocks with one
+        # sync per segment file instead of scattering small ones. Commits are
+        # grouped to about batch_size messages.
+        archived = uncommitted = 0
+        for lo, hi in conversations:
+            newest = self.newest_hot_id(db, lo, hi)
+            while True:
+                messages = db.query(Message).filter(
+                    or_(
+                        (Message.sender_id == lo) & (Message.recipient_id == hi),
+                        (Message.sender_id == hi) & (Message.recipient_id == lo)
+                    ),
+                    Message.timestamp < cutoff,
+                    Message.read == True,
+                    Message.id != newest
+                ).order_by(Message.id).limit(batch_size).all()
+                if not messages:
+                    break
+                self._append(db, lo, hi, [self._to_row(message) for message in messages])
+                db.query(Message).filter(
+                    Message.id.in_([message.id for message in messages])
+                ).delete(synchronize_session=False)
+                archived += len(messages)
+                uncommitted += len(messages)
+                if len(messages) < batch_size:
+                    break
+            if uncommitted >= batch_size:
+                db.commit()
+                db.expunge_all()
+                self.stats["archived"] += uncommitted
+                uncommitted = 0
+        db.commit()
+        self.stats["archived"] += uncommitted
+        return archived
+
+    @staticmethod
+    def newest_hot_id(db: Session, user_lo: int, user_hi: int) -> Optional[int]:
+        # Two range scans on the conversation indexes, one per direction
+        newest = [
+            db.query(func.max(Message.id)).filter(Message.sender_id == sender, Message.recipient_id == recipient).scalar()
+            for sender, recipient in ((user_lo, user_hi), (user_hi, user_lo))
+        ]
+        return max((value for value in newest if value is not None), default=None)
+
+    def _append(self, db: Session, user_lo: int, user_hi: int, rows: List[Row]) -> None:
+        latest = db.query(ArchiveBlock.segment).filter(
+            ArchiveBlock.user_lo == user_lo, ArchiveBlock.user_hi == user_hi
+        ).order_by(ArchiveBlock.id.desc()).first()
+        segment = latest[0] if latest else self._new_segment_name(user_lo, user_hi)
+        for block, (offset, length) in zip(self._chunks(rows), self._write_blocks(segment, rows, append=True)):
+            db.add(ArchiveBlock(
+                user_lo=user_lo, user_hi=user_hi, segment=segment, offset=offset, length=length,
+                first_id=block[0][0], last_id=block[-1][0], count=len(block)
+            ))
+        db.flush()
+
+    # Compaction
+
+    def compact(self, db: Session) -> int:
+        # Rewrites conversations whose blocks are fragmented by repeated archive
+        # runs, or that hold deleted messages, into a fresh segment of full blocks
+        candidates = set()
+        for user_lo, user_hi, blocks, messages in db.query(
+            ArchiveBlock.user_lo, ArchiveBlock.user_hi, func.count(ArchiveBlock.id), func.sum(ArchiveBlock.count)
+        ).group_by(ArchiveBlock.user_lo, ArchiveBlock.user_hi):
+            if blocks > math.ceil(messages / self.block_messages):
+                candidates.add((user_lo, user_hi))
+        candidates.update(db.query(ArchiveBlock.user_lo, ArchiveBlock.user_hi).join(
+            ArchiveDeletion, ArchiveDeletion.block_id == ArchiveBlock.id
+        ).distinct().all())
+
+        for user_lo, user_hi in sorted(candidates):
+            self._compact_conversation(db, user_lo, user_hi)
+        self.stats["compacted_conversations"] += len(candidates)
+        return len(candidates)
+
+    def _compact_conversation(self, db: Session, user_lo: int, user_hi: int) -> None:
+        blocks = db.query(ArchiveBlock).filter(
+            ArchiveBlock.user_lo == user_lo, ArchiveBlock.user_hi == user_hi
+        ).order_by(ArchiveBlock.first_id).all()
+        rows = sorted(
+            (row for block in blocks for row in self._read_block(db, block)),
+            key=lambda row: row[0]
+        )
+        old_segments = {block.segment for block in blocks}
+        block_ids = [block.id for block in blocks]
+
+        # The new segment is complete on disk before the index points at it, and
+        # old files are removed only after the switch commits
+        segment = self._new_segment_name(user_lo, user_hi)
+        locations = self._write_blocks(segment, rows, append=False) if rows else []
+        db.query(ArchiveDeletion).filter(ArchiveDeletion.block_id.in_(block_ids)).delete(synchronize_session=False)
+        db.query(ArchiveBlock).filter(ArchiveBlock.id.in_(block_ids)).delete(synchronize_session=False)
+        for block in blocks:
+            db.expunge(block)
+        for block, (offset, length) in zip(self._chunks(rows), locations):
+            db.add(ArchiveBlock(
+                user_lo=user_lo, user_hi=user_hi, segment=segment, offset=offset, length=length,
+                first_id=block[0][0], last_id=block[-1][0], count=len(block)
+            ))
+        db.commit()
+
+        for block in blocks:
+            self._blocks.delete(self._block_key(block))
+        for old_segment in old_segments:
+            self._maps.delete(old_segment)
+            try:
+                os.remove(self._path(old_segment))
+            except FileNotFoundError:
+                pass
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats, cached_blocks=len(self._blocks))
+
+    # Segment files
+
+    def _conversation_filter(self, user1_id: int, user2_id: int):
+        user_lo, user_hi = _pair(user1_id, user2_id)
+        return ArchiveBlock.user_lo == user_lo, ArchiveBlock.user_hi == user_hi
+
+    def _conversation_blocks(self, db: Session, user1_id: int, user2_id: int):
+        return db.query(ArchiveBlock).filter(*self._conversation_filter(user1_id, user2_id))
+
+    def _chunks(self, rows: List[Row]) -> Iterable[List[Row]]:
+        for start in range(0, len(rows), self.block_messages):
+            yield rows[start:start + self.block_messages]
+
+    def _write_blocks(self, segment: str, rows: List[Row], append: bool) -> List[Tuple[int, int]]:
+        path = self._path(segment)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        locations = []
+        with open(path, "ab" if append else "wb") as f:
+            offset = f.seek(0, os.SEEK_END)
+            for block in self._chunks(rows):
+                data = zlib.compress(json.dumps(block, separators=(",", ":")).encode(), 6)
+                f.write(data)
+                locations.append((offset, len(data)))
+                offset += len(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return locations
+
+    @staticmethod
+    def _block_key(block: ArchiveBlock) -> Tuple[str, int, int]:
+        return (block.segment, block.offset, block.length)
+
+    def _read_block(self, db: Session, block: ArchiveBlock) -> List[Row]:
+        key = self._block_key(block)
+        rows = self._blocks.get(key)
+        if rows is None:
+            self.stats["block_reads"] += 1
+            data = self._map(block.segment, block.offset + block.length)[block.offset:block.offset + block.length]
+            rows = [tuple(row) for row in json.loads(zlib.decompress(data))]
+            self._blocks.set(key, rows)
+        deleted = {
+            message_id for (message_id,) in
+            db.query(ArchiveDeletion.message_id).filter(ArchiveDeletion.block_id == block.id)
+        }
+        return [row for row in rows if row[0] not in deleted] if deleted else rows
+
+    def _map(self, segment: str, needed: int) -> mmap.mmap:
+        mapped = self._maps.get(segment)
+        # Appends grow the file, so a mapping made earlier may be too short
+        if mapped is None or len(mapped) < needed:
+            with open(self._path(segment), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps.set(segment, mapped)
+        return mapped
+
+    def _new_segment_name(self, user_lo: int, user_hi: int) -> str:
+        # Spread conversations over subdirectories so no directory grows too large
+        return os.path.join(f"{user_lo % 256:02x}", f"{user_lo}-{user_hi}-{time.time_ns():x}.seg")
+
+    def _path(self, segment: str) -> str:
+        return os.path.join(self.root, segment)
+
+    @staticmethod
+    def _to_row(message: Message) -> Row:
+        return (message.id, message.sender_id, message.recipient_id, message.content, message.timestamp.isoformat())
+
+    @staticmethod
+    def _to_message(row: Row) -> Message:
+        # Detached rows, never added to a session; archived messages are always read
+        message_id, sender_id, recipient_id, content, timestamp = row
+        return Message(
+            id=message_id,
+            sender_id=sender_id,
+            recipient_id=recipient_id,
+            content=content,
+            timestamp=datetime.fromisoformat(timestamp),
+            read=True
+        )
+
+def archive_cutoff(days: float = MESSAGE_ARCHIVE_AFTER_DAYS) -> datetime:
+    return datetime.utcnow() - timedelta(days=days)
+
+def _pair(user1_id: int, user2_id: int) -> Tuple[int, int]:
+    return (user1_id, user2_id) if user1_id <= user2_id else (user2_id, user1_id)
@@ -1,72 +1,208 @@
+from sqlalchemy import Float, Text, case, func, select, text
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from datetime import datetime
+import re
 
-from ..models.database import Message, User
+from ..models.database import MESSAGE_SEARCH_AVAILABLE, DBSession, Message, User, run_in_session
+from .realtime import ConnectionHub
+from .message_archive import MessageArchive
+
+SEARCH_MAX_TERMS = 16
+SNIPPET_TOKENS = 12
+
+# Ranked by bm25 over the message text only; the participants column just scopes the match
+SEARCH_QUERY = text("""
+    SELECT m.id, m.sender_id, m.recipient_id, m.timestamp, m.read,
+           snippet(messages_fts, 0, '<mark>', '</mark>', '…', :snippet_tokens) AS snippet,
+           bm25(messages_fts, 1.0, 0.0) AS score
+    FROM messages_fts
+    JOIN messages AS m ON m.id = messages_fts.rowid
+    WHERE messages_fts MATCH :match
+    ORDER BY score, m.id DESC
+    LIMIT :limit OFFSET :offset
+""").columns(
+    Message.id, Message.sender_id, Message.recipient_id, Message.timestamp, Message.read,
+    snippet=Text, score=Float
+)
+
+def build_match_expression(query: str, user_id: int, other_user_id: Optional[int] = None) -> Optional[str]:
+    # User input never reaches FTS5 syntax directly: every word becomes a quoted
+    # term, so operators and stray quotes are searched for as plain text
+    terms = re.findall(r"\w+", query.lower())[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    participants = f'"u{user_id}"' if other_user_id is None else f'"u{user_id}" "u{other_user_id}"'
+    content = " ".join(f'"{term}"' for term in terms)
+    return f"participants : ({participants}) AND content : ({content})"
 
 class MessageService:
-    def __init__(self, db: Session):
+    search_available = MESSAGE_SEARCH_AVAILABLE
+
+    def __init__(self, db: DBSession, hub: Optional[ConnectionHub] = None, archive: Optional[MessageArchive] = None):
         self.db = db
+        self.hub = hub
+        self.archive = archive
+
+    async def create_message(self, sender_id: int, recipient_id: int, content: str) -> Message:
+        message, unread_count = await self._insert_message(sender_id, recipient_id, content)
+        if self.hub:
+            # Push the message and the conversation's new unread count to the recipient's sockets
+            await self.hub.publish(recipient_id, {
+                "type": "message",
+                "message": self._serialize(message),
+                "unread_count": unread_count
+            })
+        return message
 
-    def create_message(self, sender_id: int, recipient_id: int, content: str) -> Message:
+    @run_in_session
+    def _insert_message(self, db: Session, sender_id: int, recipient_id: int, content: str) -> Tuple[Message, int]:
         message = Message(
             sender_id=sender_id,
             recipient_id=recipient_id,
             content=content,
             timestamp=datetime.utcnow()
         )
-        self.db.add(message)
-        self.db.commit()
-        self.db.refresh(message)
-        return message
+        db.add(message)
+        db.commit()
+        db.refresh(message)
+        unread_count = db.query(func.count(Message.id)).filter(
+            (Message.recipient_id == recipient_id) &
+            (Message.sender_id == sender_id) &
+            (Message.read == False)
+        ).scalar()
+        return message, unread_count
 
-    def get_conversation(self, user1_id: int, user2_id: int, limit: int = 50) -> List[Message]:
-        return self.db.query(Message).filter(
+    @run_in_session
+    def get_conversation(
+        self,
+        db: Session,
+        user1_id: int,
+        user2_id: int,
+        limit: int = 50,
+        before: Optional[int] = None,
+        after: Optional[int] = None
+    ) -> List[Message]:
+        query = db.query(Message).filter(
             ((Message.sender_id == user1_id) & (Message.recipient_id == user2_id)) |
             ((Message.sender_id == user2_id) & (Message.recipient_id == user1_id))
-        ).order_by(Message.timestamp.desc()).limit(limit).all()
+        )
 
-    def get_user_conversations(self, user_id: int) -> List[dict]:
-        # Get all conversations where the user is either sender or recipient
-        messages = self.db.query(Message).filter(
+        # Keyset pagination on message id; results are always newest first
+        if after is not None:
+            messages = query.filter(Message.id > after).order_by(Message.id.asc()).limit(limit).all()
+            # Archived messages can only come after the cursor when it points into the archive
+            if self.archive and (len(messages) < limit or self.archive.has_after(db, user1_id, user2_id, after)):
+                archived = self.archive.read_after(db, user1_id, user2_id, after, limit)
+                messages = sorted(messages + archived, key=lambda message: message.id)[:limit]
+            return messages[::-1]
+        if before is not None:
+            query = query.filter(Message.id < before)
+        messages = query.order_by(Message.id.desc()).limit(limit).all()
+
+        # Page into the archive once the hot rows run out or archived ids interleave with them
+        if self.archive:
+            newest_archived = self.archive.newest_id(db, user1_id, user2_id, before)
+            if newest_archived is not None and (len(messages) < limit or newest_archived > messages[-1].id):
+                archived = self.archive.read_before(db, user1_id, user2_id, before, limit)
+                messages = sorted(messages + archived, key=lambda message: message.id, reverse=True)[:limit]
+        return messages
+
+    @run_in_session
+    def search_messages(
+        self,
+        db: Session,
+        user_id: int,
+        query: str,
+        other_user_id: Optional[int] = None,
+        limit: int = 20,
+        offset: int = 0
+    ) -> List[dict]:
+        match = build_match_expression(query, user_id, other_user_id)
+        if match is None:
+            return []
+        rows = db.execute(SEARCH_QUERY, {
+            "match": match,
+            "snippet_tokens": SNIPPET_TOKENS,
+            "limit": limit,
+            "offset": offset
+        }).mappings().all()
+        return [dict(row) for row in rows]
+
+    @run_in_session
+    def get_user_conversations(self, db: Session, user_id: int, limit: int = 20, before: Optional[int] = None) -> List[dict]:
+        # One row per conversation partner: the latest message plus the unread count, computed in SQL
+        partner_id = case((Message.sender_id == user_id, Message.recipient_id), else_=Message.sender_id)
+        ranked = select(
+            Message.id.label("message_id"),
+            partner_id.label("partner_id"),
+            func.row_number().over(partition_by=partner_id, order_by=Message.id.desc()).label("position"),
+            func.sum(
+                case(((Message.recipient_id == user_id) & (Message.read == False), 1), else_=0)
+            ).over(partition_by=partner_id).label("unread_count"),
+        ).where(
             (Message.sender_id == user_id) | (Message.recipient_id == user_id)
-        ).order_by(Message.timestamp.desc()).all()
-
-        # Group messages by conversation partner
-        conversations = {}
-        for message in messages:
-            other_user_id = message.recipient_id if message.sender_id == user_id else message.sender_id
-            
-            if other_user_id not in conversations:
-                other_user = self.db.query(User).filter(User.id == other_user_id).first()
-                conversations[other_user_id] = {
-                    "user": other_user,
-                    "last_message": message,
-                    "unread_count": 0
-                }
-            
-            # Count unread messages
-            if message.recipient_id == user_id and not message.read:
-                conversations[other_user_id]["unread_count"] += 1
-
-        return list(conversations.values())
-
-    def mark_messages_as_read(self, recipient_id: int, sender_id: int) -> None:
-        self.db.query(Message).filter(
+        ).subquery()
+
+        query = db.query(Message, User, ranked.c.unread_count).join(
+            ranked, Message.id == ranked.c.message_id
+        ).join(
+            User, User.id == ranked.c.partner_id
+        ).filter(ranked.c.position == 1)
+
+        # Keyset pagination on the id of each conversation's latest message
+        if before is not None:
+            query = query.filter(Message.id < before)
+
+        rows = query.order_by(Message.id.desc()).limit(limit).all()
+
+        return [
+            {
+                "user": {"id": other_user.id, "username": other_user.username},
+                "last_message": self._serialize(message),
+                "unread_count": unread_count or 0
+            }
+            for message, other_user, unread_count in rows
+        ]
+
+    async def mark_messages_as_read(self, recipient_id: int, sender_id: int) -> None:
+        updated = await self._mark_messages_as_read(recipient_id, sender_id)
+        if updated and self.hub:
+            # Other open tabs of the reader clear their unread badge
+            await self.hub.publish(recipient_id, {"type": "read", "user_id": sender_id, "unread_count": 0})
+
+    @staticmethod
+    def _serialize(message: Message) -> dict:
+        return {
+            "id": message.id,
+            "sender_id": message.sender_id,
+            "recipient_id": message.recipient_id,
+            "content": message.content,
+            "timestamp": message.timestamp,
+            "read": message.read
+        }
+
+    @run_in_session
+    def _mark_messages_as_read(self, db: Session, recipient_id: int, sender_id: int) -> int:
+        updated = db.query(Message).filter(
             (Message.recipient_id == recipient_id) &
             (Message.sender_id == sender_id) &
             (Message.read == False)
         ).update({"read": True})
-        self.db.commit()
+        db.commit()
+        return updated
 
-    def delete_message(self, message_id: int, user_id: int) -> bool:
-        message = self.db.query(Message).filter(
+    @run_in_session
+    def delete_message(self, db: Session, message_id: int, user_id: int) -> bool:
+        message = db.query(Message).filter(
             Message.id == message_id,
             (Message.sender_id == user_id) | (Message.recipient_id == user_id)
         ).first()
         
         if message:
-            self.db.delete(message)
-            self.db.commit()
+            db.delete(message)
+            db.commit()
             return True
+        if self.archive:
+            return self.archive.delete(db, message_id, user_id)
         return False
\ No newline at end of file
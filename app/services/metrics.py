@@ -0,0 +1,158 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+import math
+import re
+import threading
+import time
+
+# Latency buckets in seconds, from sub-millisecond cache hits up to slow Claude calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def values(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            return dict(self._values)
+
+class Gauge(Counter):
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: non-cumulative bucket counts (last slot is +Inf), sum and count
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def values(self) -> Dict[LabelValues, Dict]:
+        with self._lock:
+            snapshot = {key: (list(counts), total[0]) for key, (counts, total) in self._values.items()}
+        results = {}
+        for key, (counts, total) in snapshot.items():
+            cumulative, running = [], 0
+            for count in counts:
+                running += count
+                cumulative.append(running)
+            results[key] = {"buckets": cumulative, "sum": total, "count": running}
+        return results
+
+# Process-wide collection of metrics, so services can declare theirs at import time.
+# Collectors expose existing get_stats() dictionaries as gauges when scraped.
+class MetricsRegistry:
+    def __init__(self, namespace: str = "chatbot"):
+        self.namespace = namespace
+        self.metrics: Dict[str, object] = {}
+        self.collectors: Dict[str, Callable[[], Dict]] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, prefix: str, get_stats: Callable[[], Dict]) -> None:
+        with self._lock:
+            self.collectors[prefix] = get_stats
+
+    def _register(self, metric):
+        with self._lock:
+            # Re-registering returns the existing metric, e.g. when a module is reloaded
+            return self.metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        # Prometheus text exposition format, version 0.0.4
+        lines: List[str] = []
+        for metric in list(self.metrics.values()):
+            name = f"{self.namespace}_{metric.name}"
+            kind = "histogram" if isinstance(metric, Histogram) else "gauge" if isinstance(metric, Gauge) else "counter"
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            if isinstance(metric, Histogram):
+                for key, value in sorted(metric.values().items()):
+                    labels = dict(zip(metric.labelnames, key))
+                    for bound, count in zip(metric.buckets + (math.inf,), value["buckets"]):
+                        le = "+Inf" if bound == math.inf else repr(bound)
+                        lines.append(f"{name}_bucket{_labels(dict(labels, le=le))} {count}")
+                    lines.append(f"{name}_sum{_labels(labels)} {value['sum']}")
+                    lines.append(f"{name}_count{_labels(labels)} {value['count']}")
+            else:
+                for key, value in sorted(metric.values().items()):
+                    lines.append(f"{name}{_labels(dict(zip(metric.labelnames, key)))} {value}")
+
+        for prefix, get_stats in list(self.collectors.items()):
+            try:
+                stats = get_stats()
+            except Exception as e:
+                print(f"Error collecting {prefix} metrics: {e}")
+                continue
+            for key, value in sorted(stats.items()):
+                if isinstance(value, (bool, int, float)):
+                    name = f"{self.namespace}_{prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', key)}"
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.append(f"{name} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+REGISTRY = MetricsRegistry()
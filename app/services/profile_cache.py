@@ -0,0 +1,100 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import os
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from ..models.database import User
+from .cache import LRUCache
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "300"))
+
+# Everything profile, search and suggestion responses need from SQLite and the
+# graph, detached from any session. Immutable, so one record can be handed to
+# many requests; characteristics are kept as pairs rather than a dict.
+@dataclass(frozen=True)
+class ProfileRecord:
+    __slots__ = ("id", "username", "email", "created_at", "characteristics")
+    id: int
+    username: str
+    email: str
+    created_at: Optional[datetime]
+    characteristics: Tuple[Tuple[str, str], ...]
+
+    def characteristics_dict(self) -> Dict[str, str]:
+        return dict(self.characteristics)
+
+# Read-through cache keyed by user id. Each invalidation bumps the user's
+# version; a fill that started before the bump is discarded, so a slow read
+# racing a write can never put the old profile back.
+class ProfileCache:
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        self._cache = LRUCache(max_size=max_size, ttl=ttl)
+        self._versions: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.invalidations = 0
+        self.stale_fills = 0
+
+    def get_many(self, user_ids: Iterable[int]) -> Dict[int, ProfileRecord]:
+        records = {}
+        for user_id in user_ids:
+            record = self._cache.get(user_id)
+            if record is not None:
+                records[user_id] = record
+        return records
+
+    def versions(self, user_ids: Iterable[int]) -> Dict[int, int]:
+        with self._lock:
+            return {user_id: self._versions.get(user_id, 0) for user_id in user_ids}
+
+    def put_many(self, records: List[ProfileRecord], versions: Dict[int, int]) -> None:
+        with self._lock:
+            for record in records:
+                if self._versions.get(record.id, 0) != versions.get(record.id):
+                    self.stale_fills += 1
+                    continue
+                self._cache.set(record.id, record)
+
+    def invalidate(self, user_id: int) -> None:
+        self.invalidate_many([user_id])
+
+    def invalidate_many(self, user_ids: Iterable[int]) -> None:
+        with self._lock:
+            for user_id in user_ids:
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+                self._cache.delete(user_id)
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._versions.clear()
+            self._cache.clear()
+
+    def get_stats(self) -> Dict[str, float]:
+        return dict(self._cache.get_stats(), invalidations=self.invalidations, stale_fills=self.stale_fills)
+
+profile_cache = ProfileCache(max_size=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL)
+
+# User rows are invalidated when flushed and again once the transaction commits,
+# since a read between the two still sees the old committed row
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_profile(mapper, connection, target: User) -> None:
+    profile_cache.invalidate(target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("profile_invalidations", set()).add(target.id)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_profiles(session: Session) -> None:
+    user_ids = session.info.pop("profile_invalidations", None)
+    if user_ids:
+        profile_cache.invalidate_many(user_ids)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_profiles(session: Session) -> None:
+    session.info.pop("profile_invalidations", None)
@@ -1,75 +1,138 @@
 from sqlalchemy.orm import Session
-from typing import Dict, List, Optional
-from ..models.database import User
+from typing import Dict, List, Optional, Tuple
+import asyncio
+from ..models.database import DBSession, User, run_in_session
 from .graph_db import GraphService
+from .characteristic_writer import CharacteristicWriter
+from .similarity_index import SimilarityIndex
+from .profile_cache import ProfileCache, ProfileRecord
 
 class ProfileService:
-    def __init__(self, db: Session, graph_service: GraphService):
+    def __init__(
+        self,
+        db: DBSession,
+        graph_service: GraphService,
+        characteristic_writer: Optional[CharacteristicWriter] = None,
+        similarity_index: Optional[SimilarityIndex] = None,
+        profile_cache: Optional[ProfileCache] = None
+    ):
         self.db = db
         self.graph_service = graph_service
+        self.characteristic_writer = characteristic_writer
+        self.similarity_index = similarity_index
+        self.profile_cache = profile_cache
 
-    def create_user(self, username: str, email: str, hashed_password: str) -> User:
+    @run_in_session
+    def create_user(self, db: Session, username: str, email: str, hashed_password: str) -> User:
         user = User(
             username=username,
             email=email,
             hashed_password=hashed_password
         )
-        self.db.add(user)
-        self.db.commit()
-        self.db.refresh(user)
+        db.add(user)
+        db.commit()
+        db.refresh(user)
         return user
 
-    def get_user_profile(self, user_id: int) -> Dict:
-        user = self.db.query(User).filter(User.id == user_id).first()
-        if not user:
+    async def get_user_profile(self, user_id: int) -> Dict:
+        record = (await self._get_profiles([user_id])).get(user_id)
+        if not record:
             return None
 
-        characteristics = self.graph_service.get_user_characteristics(str(user_id))
-        
         return {
-            "id": user.id,
-            "username": user.username,
-            "email": user.email,
-            "characteristics": characteristics,
-            "created_at": user.created_at
+            "id": record.id,
+            "username": record.username,
+            "email": record.email,
+            "characteristics": record.characteristics_dict(),
+            "created_at": record.created_at
         }
 
-    def update_user_characteristics(self, user_id: int, characteristics: Dict[str, str]) -> None:
-        for char, value in characteristics.items():
-            self.graph_service.add_user_characteristic(str(user_id), char, value)
+    def update_user_characteristics(self, user_id: int, characteristics: List[Tuple[str, str]]) -> None:
+        if self.similarity_index:
+            self.similarity_index.add(str(user_id), characteristics)
+        if self.characteristic_writer:
+            self.characteristic_writer.submit(str(user_id), characteristics)
+        else:
+            self.graph_service.add_characteristics_batch([
+                {"username": str(user_id), "name": char, "value": value} for char, value in characteristics
+            ])
+        # Queued writes invalidate the profile again once the writer flushes them
+        if self.profile_cache:
+            self.profile_cache.invalidate(user_id)
 
-    def search_users(self, criteria: Dict[str, str], exclude_user_id: Optional[int] = None) -> List[Dict]:
-        matching_usernames = self.graph_service.find_users_by_characteristics(criteria)
-        
-        users = []
-        for username in matching_usernames:
-            user = self.db.query(User).filter(User.username == username).first()
-            if user and (not exclude_user_id or user.id != exclude_user_id):
-                characteristics = self.graph_service.get_user_characteristics(str(user.id))
-                users.append({
-                    "id": user.id,
-                    "username": user.username,
-                    "characteristics": characteristics
-                })
-        
-        return users
+    async def search_users(
+        self,
+        criteria: Dict[str, str],
+        exclude_user_id: Optional[int] = None,
+        limit: int = 20,
+        ranked: bool = True
+    ) -> List[Dict]:
+        if not ranked:
+            matching_usernames = await asyncio.to_thread(self.graph_service.find_users_by_characteristics, criteria)
+            return await self._build_user_results(matching_usernames, exclude_user_id)
 
-    def get_user_suggestions(self, user_id: int, limit: int = 5) -> List[Dict]:
-        user = self.db.query(User).filter(User.id == user_id).first()
-        if not user:
+        # Ask for one extra so excluding the caller still leaves `limit` results
+        ranked_users = await asyncio.to_thread(self.graph_service.search_users_ranked, criteria, limit + 1)
+        scores = dict(ranked_users)
+        results = await self._build_user_results([username for username, _ in ranked_users], exclude_user_id)
+        for result in results[:limit]:
+            result["score"] = scores[str(result["id"])]
+        return results[:limit]
+
+    async def get_user_suggestions(self, user_id: int, limit: int = 5) -> List[Dict]:
+        if user_id not in await self._get_profiles([user_id]):
+            return []
+
+        if self.similarity_index and self.similarity_index.ready:
+            similar_usernames = self.similarity_index.top_k(str(user_id), limit)
+        else:
+            # Until the first rebuild completes, fall back to the graph traversal
+            similar_usernames = await asyncio.to_thread(self.graph_service.find_similar_users, str(user_id), limit)
+        return await self._build_user_results(similar_usernames, user_id)
+
+    async def _build_user_results(self, graph_usernames: List[str], exclude_user_id: Optional[int] = None) -> List[Dict]:
+        user_ids = [int(name) for name in graph_usernames if name.isdigit() and int(name) != exclude_user_id]
+        if not user_ids:
             return []
 
-        similar_usernames = self.graph_service.find_similar_users(str(user_id), limit)
-        
-        suggestions = []
-        for username in similar_usernames:
-            other_user = self.db.query(User).filter(User.username == username).first()
-            if other_user:
-                characteristics = self.graph_service.get_user_characteristics(str(other_user.id))
-                suggestions.append({
-                    "id": other_user.id,
-                    "username": other_user.username,
-                    "characteristics": characteristics
-                })
-        
-        return suggestions
\ No newline at end of file
+        profiles = await self._get_profiles(user_ids)
+        return [
+            {
+                "id": profiles[user_id].id,
+                "username": profiles[user_id].username,
+                "characteristics": profiles[user_id].characteristics_dict()
+            }
+            for user_id in user_ids if user_id in profiles
+        ]
+
+    async def _get_profiles(self, user_ids: List[int]) -> Dict[int, ProfileRecord]:
+        profiles = self.profile_cache.get_many(user_ids) if self.profile_cache else {}
+        missing = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in profiles]
+        if not missing:
+            return profiles
+
+        # Versions are taken before reading so a write landing mid-read discards the fill
+        versions = self.profile_cache.versions(missing) if self.profile_cache else {}
+        # Graph user nodes are keyed by the SQLite user id, so both lookups are a single batched read
+        users = await self._get_users(missing)
+        characteristics = await asyncio.to_thread(
+            self.graph_service.get_users_characteristics, [str(user.id) for user in users]
+        )
+        records = [
+            ProfileRecord(
+                id=user.id,
+                username=user.username,
+                email=user.email,
+                created_at=user.created_at,
+                characteristics=tuple(characteristics.get(str(user.id), {}).items())
+            )
+            for user in users
+        ]
+        if self.profile_cache:
+            self.profile_cache.put_many(records, versions)
+        profiles.update((record.id, record) for record in records)
+        return profiles
+
+    @run_in_session
+    def _get_users(self, db: Session, user_ids: List[int]) -> List[User]:
+        return db.query(User).filter(User.id.in_(user_ids)).all()
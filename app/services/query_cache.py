@@ -0,0 +1,157 @@
+from typing import Dict, Iterator, Optional
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from .cache import LRUCache
+
+FILLER_WORDS = {
+    "a", "an", "and", "any", "anyone", "are", "find", "for", "in", "into", "is", "like", "likes",
+    "me", "of", "people", "person", "show", "someone", "that", "the", "to",
+    "user", "users", "who", "with",
+}
+
+def normalize_query(query: str) -> str:
+    # Case, punctuation and filler words rarely change the criteria Claude produces;
+    # word order and negation do ("not chess", "chess not football"), so they are kept
+    tokens = re.findall(r"[a-z0-9+#]+", query.lower())
+    return " ".join(token for token in tokens if token not in FILLER_WORDS)
+
+def token_similarity(a: str, b: str) -> float:
+    tokens_a, tokens_b = set(a.split()), set(b.split())
+    if not tokens_a or not tokens_b:
+        return 0.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+
+
+class MemoryQueryStore:
+    def __init__(self, max_size: int, ttl: float):
+        self.cache = LRUCache(max_size=max_size, ttl=ttl)
+
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        return self.cache.get(key)
+
+    def set(self, key: str, value: Dict[str, str]) -> None:
+        self.cache.set(key, value)
+
+    def keys(self) -> Iterator[str]:
+        return self.cache.keys()
+
+    def size(self) -> int:
+        return len(self.cache)
+
+
+# SQLite-backed store so every worker process on the host shares the same hits
+class DiskQueryStore:
+    def __init__(self, path: str, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_query_cache_accessed ON query_cache (accessed_at)")
+
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value, created_at FROM query_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] + self.ttl < now:
+                self.conn.execute("DELETE FROM query_cache WHERE key = ?", (key,))
+                return None
+            self.conn.execute("UPDATE query_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Dict[str, str]) -> None:
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO query_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            self.conn.execute(
+                "DELETE FROM query_cache WHERE created_at < ? OR key IN ("
+                "SELECT key FROM query_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (now - self.ttl, self.max_size)
+            )
+
+    def keys(self) -> Iterator[str]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT key FROM query_cache WHERE created_at >= ?", (time.time() - self.ttl,)
+            ).fetchall()
+        return iter(row[0] for row in rows)
+
+    def size(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT count(*) FROM query_cache").fetchone()[0]
+
+
+class QueryCache:
+    def __init__(self, store, fuzzy_threshold: float = 0.0):
+        self.store = store
+        self.fuzzy_threshold = fuzzy_threshold
+        self.stats = {"hits": 0, "fuzzy_hits": 0, "misses": 0}
+
+    def get(self, query: str) -> Optional[Dict[str, str]]:
+        key = normalize_query(query)
+        if not key:
+            # Filler-only queries say nothing to key on
+            self.stats["misses"] += 1
+            return None
+        value = self.store.get(key)
+        if value is not None:
+            self.stats["hits"] += 1
+            return value
+
+        if self.fuzzy_threshold > 0:
+            best_key, best_score = None, self.fuzzy_threshold
+            for candidate in self.store.keys():
+                score = token_similarity(key, candidate)
+                if score >= best_score:
+                    best_key, best_score = candidate, score
+            if best_key is not None:
+                value = self.store.get(best_key)
+                if value is not None:
+                    self.stats["fuzzy_hits"] += 1
+                    return value
+
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, query: str, criteria: Dict[str, str]) -> None:
+        key = normalize_query(query)
+        if key:
+            self.store.set(key, criteria)
+
+    def get_stats(self) -> Dict[str, float]:
+        lookups = self.stats["hits"] + self.stats["fuzzy_hits"] + self.stats["misses"]
+        hits = self.stats["hits"] + self.stats["fuzzy_hits"]
+        return dict(self.stats, size=self.store.size(), hit_rate=hits / lookups if lookups else 0.0)
+
+
+def create_query_cache() -> Optional[QueryCache]:
+    backend = os.getenv("QUERY_CACHE_BACKEND", "memory")
+    max_size = int(os.getenv("QUERY_CACHE_SIZE", "1000"))
+    ttl = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+    # Near-duplicate hits ignore word order, so they are opt-in
+    fuzzy_threshold = float(os.getenv("QUERY_CACHE_FUZZY_THRESHOLD", "0"))
+
+    if backend == "none":
+        return None
+    if backend == "disk":
+        store = DiskQueryStore(os.getenv("QUERY_CACHE_PATH", "./query_cache.db"), max_size, ttl)
+    else:
+        store = MemoryQueryStore(max_size, ttl)
+    return QueryCache(store, fuzzy_threshold)
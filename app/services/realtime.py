@@ -0,0 +1,183 @@
+from fastapi import WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from typing import Callable, Dict, Optional, Set
+import asyncio
+import json
+import os
+import sqlite3
+import time
+
+EventHandler = Callable[[int, dict], None]
+
+
+# Delivers events to handlers in this process only
+class InMemoryBroker:
+    def __init__(self):
+        self.handler: Optional[EventHandler] = None
+
+    async def start(self, handler: EventHandler) -> None:
+        self.handler = handler
+
+    async def stop(self) -> None:
+        self.handler = None
+
+    async def publish(self, user_id: int, event: dict) -> None:
+        if self.handler:
+            self.handler(user_id, event)
+
+
+# Local stand-in for a multi-worker broker: every worker appends to a shared
+# SQLite outbox and tails it, so a message sent through one uvicorn worker
+# reaches sockets held by the others
+class SQLiteBroker:
+    def __init__(self, path: str, poll_interval: float = 0.05, retention: float = 60.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.handler: Optional[EventHandler] = None
+        self.last_id = 0
+        self._task: Optional[asyncio.Task] = None
+        self.conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS realtime_events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, "
+            "payload TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+
+    async def start(self, handler: EventHandler) -> None:
+        self.handler = handler
+        # Only events published after this worker started are delivered
+        self.last_id = self.conn.execute("SELECT coalesce(max(id), 0) FROM realtime_events").fetchone()[0]
+        self._task = asyncio.create_task(self._poll())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self.conn.close()
+
+    async def publish(self, user_id: int, event: dict) -> None:
+        await asyncio.to_thread(self._insert, user_id, json.dumps(jsonable_encoder(event)))
+
+    def _insert(self, user_id: int, payload: str) -> None:
+        now = time.time()
+        self.conn.execute(
+            "INSERT INTO realtime_events (user_id, payload, created_at) VALUES (?, ?, ?)",
+            (user_id, payload, now)
+        )
+        self.conn.execute("DELETE FROM realtime_events WHERE created_at < ?", (now - self.retention,))
+
+    def _fetch(self):
+        return self.conn.execute(
+            "SELECT id, user_id, payload FROM realtime_events WHERE id > ? ORDER BY id", (self.last_id,)
+        ).fetchall()
+
+    async def _poll(self) -> None:
+        while True:
+            try:
+                for event_id, user_id, payload in await asyncio.to_thread(self._fetch):
+                    self.last_id = event_id
+                    if self.handler:
+                        self.handler(user_id, json.loads(payload))
+            except Exception as e:
+                print(f"Error polling realtime events: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+
+class Connection:
+    def __init__(self, websocket: WebSocket, max_queue: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.sender: Optional[asyncio.Task] = None
+        self.overflowed = False
+
+
+class ConnectionHub:
+    def __init__(self, broker, max_queue: int = 100):
+        self.broker = broker
+        self.max_queue = max_queue
+        self.connections: Dict[int, Set[Connection]] = {}
+        self.stats = {"published": 0, "delivered": 0, "dropped_slow_clients": 0}
+
+    async def start(self) -> None:
+        await self.broker.start(self._deliver)
+
+    async def stop(self) -> None:
+        await self.broker.stop()
+
+    async def publish(self, user_id: int, event: dict) -> None:
+        self.stats["published"] += 1
+        await self.broker.publish(user_id, event)
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(
+            self.stats,
+            users=len(self.connections),
+            connections=sum(len(conns) for conns in self.connections.values())
+        )
+
+    def _deliver(self, user_id: int, event: dict) -> None:
+        for connection in list(self.connections.get(user_id, ())):
+            try:
+                connection.queue.put_nowait(event)
+                self.stats["delivered"] += 1
+            except asyncio.QueueFull:
+                # A client that cannot keep up is disconnected rather than buffered
+                # without bound; it resyncs over REST when it reconnects
+                if not connection.overflowed:
+                    connection.overflowed = True
+                    self.stats["dropped_slow_clients"] += 1
+                    if connection.sender:
+                        connection.sender.cancel()
+                    asyncio.create_task(self._close(connection.websocket))
+
+    async def serve(self, user_id: int, websocket: WebSocket) -> None:
+        connection = Connection(websocket, self.max_queue)
+        self.connections.setdefault(user_id, set()).add(connection)
+        connection.sender = asyncio.create_task(self._send_events(connection))
+        try:
+            # Incoming frames are only keep-alives; the loop ends when the client disconnects
+            while True:
+                await websocket.receive_text()
+        except (WebSocketDisconnect, RuntimeError):
+            # RuntimeError is raised when the hub already closed a slow connection
+            pass
+        finally:
+            connection.sender.cancel()
+            conns = self.connections.get(user_id)
+            if conns is not None:
+                conns.discard(connection)
+                if not conns:
+                    del self.connections[user_id]
+
+    @staticmethod
+    async def _send_events(connection: Connection) -> None:
+        try:
+            while True:
+                event = await connection.queue.get()
+                await connection.websocket.send_text(json.dumps(jsonable_encoder(event)))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The receive loop notices the disconnect and cleans up
+            pass
+
+    @staticmethod
+    async def _close(websocket: WebSocket) -> None:
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
+
+def create_broker():
+    if os.getenv("REALTIME_BROKER", "memory") == "sqlite":
+        return SQLiteBroker(
+            os.getenv("REALTIME_BROKER_PATH", "./realtime.db"),
+            poll_interval=float(os.getenv("REALTIME_POLL_INTERVAL", "0.05"))
+        )
+    return InMemoryBroker()
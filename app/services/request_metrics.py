@@ -0,0 +1,94 @@
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from typing import Dict, Optional
+import time
+
+from .metrics import REGISTRY
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ["method", "route", "status"]
+)
+REQUESTS_IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "HTTP requests currently being served")
+REQUEST_SQL_QUERIES = REGISTRY.histogram(
+    "http_request_sql_queries", "SQL statements executed per request", ["route"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100)
+)
+REQUEST_GRAPH_SESSIONS = REGISTRY.histogram(
+    "http_request_graph_sessions", "Graph database sessions opened per request", ["route"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100)
+)
+SQL_QUERIES = REGISTRY.counter("sql_queries_total", "SQL statements executed")
+
+class RequestStats:
+    __slots__ = ("sql_queries", "graph_sessions")
+
+    def __init__(self):
+        self.sql_queries = 0
+        self.graph_sessions = 0
+
+# Set for the duration of an HTTP request. asyncio.to_thread and run_sync carry
+# the context along, so work done on behalf of a request is counted against it.
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+def count_graph_session() -> None:
+    stats = current_request.get()
+    if stats is not None:
+        stats.graph_sessions += 1
+
+def install_sql_counter(engine: Engine) -> None:
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count_query(*_):
+        SQL_QUERIES.inc()
+        stats = current_request.get()
+        if stats is not None:
+            stats.sql_queries += 1
+
+# Plain ASGI middleware rather than BaseHTTPMiddleware, which would add a task
+# and a response copy to every request
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[object, str] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            REQUESTS_IN_FLIGHT.dec()
+            current_request.reset(token)
+            # Label by route template, not raw path, to keep cardinality bounded
+            route = self._route_path(scope)
+            REQUEST_LATENCY.observe(elapsed, method=scope["method"], route=route, status=status[0])
+            REQUEST_SQL_QUERIES.observe(stats.sql_queries, route=route)
+            REQUEST_GRAPH_SESSIONS.observe(stats.graph_sessions, route=route)
+
+    def _route_path(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._routes.get(endpoint)
+        if path is None:
+            path = "unmatched"
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", getattr(route, "app", None)) is endpoint:
+                    path = route.path
+                    break
+            self._routes[endpoint] = path
+        return path
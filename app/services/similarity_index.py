@@ -0,0 +1,143 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
+import heapq
+import math
+import threading
+
+from .characteristic_writer import CharacteristicWriter
+from .graph_db import GraphService
+
+Feature = Tuple[str, str]
+
+# In-memory sparse user x characteristic index answering "users like me" with
+# IDF-weighted overlap. Neo4j stays the source of truth: the index is rebuilt
+# from it on startup and periodically, and updated incrementally in between.
+class SimilarityIndex:
+    def __init__(self, max_postings: int = 5000):
+        # Characteristics shared by more users than this carry almost no IDF
+        # weight and would dominate the scan, so they are skipped when scoring
+        self.max_postings = max_postings
+        self.user_features: Dict[str, Set[Feature]] = {}
+        self.postings: Dict[Feature, Set[str]] = defaultdict(set)
+        self.ready = False
+        self._lock = threading.Lock()
+        # Updates made while a rebuild reads its snapshot, replayed onto it before the swap
+        self._replay: Optional[List[Tuple[str, List[Feature]]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"queries": 0, "updates": 0, "rebuilds": 0}
+
+    def add(self, username: str, characteristics: List[Feature]) -> None:
+        with self._lock:
+            pairs = list(characteristics)
+            self._add_pairs(self.user_features, self.postings, username, pairs)
+            if self._replay is not None:
+                self._replay.append((username, pairs))
+            self.stats["updates"] += 1
+
+    @staticmethod
+    def _add_pairs(
+        user_features: Dict[str, Set[Feature]],
+        postings: Dict[Feature, Set[str]],
+        username: str,
+        pairs: Iterable[Feature]
+    ) -> None:
+        features = user_features.setdefault(username, set())
+        for feature in pairs:
+            features.add(feature)
+            postings[feature].add(username)
+
+    def rebuild(
+        self,
+        rows: Iterable[Tuple[str, str, str]],
+        unflushed: Optional[Dict[str, Set[Feature]]] = None
+    ) -> None:
+        user_features: Dict[str, Set[Feature]] = {}
+        postings: Dict[Feature, Set[str]] = defaultdict(set)
+        for username, name, value in rows:
+            self._add_pairs(user_features, postings, username, [(name, value)])
+        # Writes still waiting in the characteristic writer are not in the snapshot yet
+        for username, pairs in (unflushed or {}).items():
+            self._add_pairs(user_features, postings, username, pairs)
+        with self._lock:
+            for username, pairs in self._replay or ():
+                self._add_pairs(user_features, postings, username, pairs)
+            self.user_features = user_features
+            self.postings = postings
+            self.ready = True
+            self.stats["rebuilds"] += 1
+
+    def _idf(self, feature: Feature) -> float:
+        return math.log((len(self.user_features) + 1) / (len(self.postings[feature]) + 1)) + 1
+
+    def top_k(self, username: str, k: int = 5) -> List[str]:
+        with self._lock:
+            self.stats["queries"] += 1
+            features = self.user_features.get(username)
+            if not features:
+                return []
+
+            scores: Dict[str, float] = defaultdict(float)
+            for feature in features:
+                posting = self.postings.get(feature, ())
+                if len(posting) > self.max_postings:
+                    continue
+                weight = self._idf(feature) ** 2
+                for other in posting:
+                    if other != username:
+                        scores[other] += weight
+
+            # Dampen users who simply have a lot of characteristics
+            return [
+                other for other, _ in heapq.nlargest(
+                    k,
+                    ((other, score / math.sqrt(len(self.user_features[other]))) for other, score in scores.items()),
+                    key=lambda item: item[1]
+                )
+            ]
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats, users=len(self.user_features), characteristics=len(self.postings), ready=self.ready)
+
+    async def rebuild_from(self, graph_service: GraphService, writer: Optional[CharacteristicWriter] = None) -> None:
+        # Updates from here on are recorded. Earlier ones were handed to the writer
+        # before reaching the index, so flushing it puts them in the snapshot, or
+        # leaves them pending in the writer when the graph write fails.
+        with self._lock:
+            self._replay = []
+        try:
+            if writer:
+                await writer.flush()
+            rows = await asyncio.to_thread(graph_service.get_all_user_characteristics)
+            unflushed = writer.pending_characteristics() if writer else None
+            await asyncio.to_thread(self.rebuild, rows, unflushed)
+        finally:
+            with self._lock:
+                self._replay = None
+
+    async def start(
+        self,
+        graph_service: GraphService,
+        interval: float,
+        writer: Optional[CharacteristicWriter] = None
+    ) -> None:
+        self._task = asyncio.create_task(self._run(graph_service, interval, writer))
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, graph_service: GraphService, interval: float, writer: Optional[CharacteristicWriter]) -> None:
+        while True:
+            try:
+                await self.rebuild_from(graph_service, writer)
+            except Exception as e:
+                print(f"Error rebuilding similarity index: {e}")
+            if interval <= 0:
+                return
+            await asyncio.sleep(interval)
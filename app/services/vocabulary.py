@@ -0,0 +1,76 @@
+from typing import Dict, List
+import re
+
+# Canonical characteristic vocabulary shared by writes and searches, so free-text
+# keys and values produced by Claude ("Hobbies: Python programming") line up with
+# how the same thing was phrased when it was stored ("interest: python")
+
+KEY_ALIASES = {
+    "hobby": "interest",
+    "hobbies": "interest",
+    "interests": "interest",
+    "likes": "interest",
+    "job": "profession",
+    "job_title": "profession",
+    "occupation": "profession",
+    "career": "profession",
+    "role": "profession",
+    "work": "profession",
+    "skills": "skill",
+    "expertise": "skill",
+    "languages": "language",
+    "location": "city",
+    "hometown": "city",
+    "traits": "trait",
+    "personality": "trait",
+    "personal_trait": "trait",
+    "personal_traits": "trait",
+}
+
+# Keys that structured extraction is allowed to persist, after aliasing
+CANONICAL_KEYS = {
+    "interest",
+    "profession",
+    "skill",
+    "language",
+    "city",
+    "trait",
+    "education",
+    "goal",
+}
+
+VALUE_STOPWORDS = {"a", "an", "and", "at", "for", "in", "of", "on", "or", "the", "to", "with"}
+
+def canonical_key(key: str) -> str:
+    key = re.sub(r"[^a-z0-9]+", "_", key.strip().lower()).strip("_")
+    return KEY_ALIASES.get(key, key)
+
+def normalize_value(value: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9+#]+", value.lower()))
+
+def value_tokens(value: str) -> List[str]:
+    tokens = []
+    for token in normalize_value(value).split():
+        # Light stemming so "hiking"/"hikes"/"hike" and "games"/"game" meet
+        if len(token) > 5 and token.endswith("ing"):
+            token = token[:-3]
+        elif len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        if len(token) > 3 and token.endswith("e"):
+            token = token[:-1]
+        if token not in VALUE_STOPWORDS and token not in tokens:
+            tokens.append(token)
+    return tokens
+
+def search_criteria(characteristics: Dict[str, str], weights: Dict[str, float] = None) -> List[Dict]:
+    weights = weights or {}
+    criteria = []
+    for name, value in characteristics.items():
+        tokens = value_tokens(value)
+        if tokens:
+            criteria.append({
+                "key": canonical_key(name),
+                "tokens": tokens,
+                "weight": float(weights.get(name, 1.0))
+            })
+    return criteria
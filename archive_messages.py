@@ -0,0 +1,46 @@
+from dotenv import load_dotenv
+import argparse
+import time
+
+# Database and archive settings are read when the app modules are imported
+load_dotenv()
+
+from app.models.database import create_script_engine, init_db
+from app.services.message_archive import MESSAGE_ARCHIVE_AFTER_DAYS, MessageArchive, archive_cutoff
+from sqlalchemy.orm import Session
+
+def archive_messages(days: float, batch_size: int) -> None:
+    started = time.perf_counter()
+    with Session(create_script_engine()) as db:
+        archived = MessageArchive().archive_older_than(db, archive_cutoff(days), batch_size)
+    print(f"Archived {archived} messages older than {days:g} days in {time.perf_counter() - started:.1f}s")
+
+def compact_archive() -> None:
+    started = time.perf_counter()
+    with Session(create_script_engine()) as db:
+        compacted = MessageArchive().compact(db)
+    print(f"Compacted {compacted} conversations in {time.perf_counter() - started:.1f}s")
+
+def vacuum() -> None:
+    # Deleted rows leave free pages behind; VACUUM returns them to the filesystem
+    with create_script_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql("VACUUM")
+    print("Vacuumed database")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old messages to compressed archive segments")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    archive = subcommands.add_parser("archive", help="archive read messages older than --days")
+    archive.add_argument("--days", type=float, default=MESSAGE_ARCHIVE_AFTER_DAYS)
+    archive.add_argument("--batch-size", type=int, default=10000)
+    archive.add_argument("--vacuum", action="store_true", help="shrink the database file afterwards")
+    subcommands.add_parser("compact", help="merge fragmented blocks and drop deleted messages")
+    args = parser.parse_args()
+
+    init_db()
+    if args.command == "archive":
+        archive_messages(args.days, args.batch_size)
+        if args.vacuum:
+            vacuum()
+    else:
+        compact_archive()
@@ -0,0 +1,38 @@
+import os
+import tempfile
+from typing import Dict, List
+
+
+def configure_offline_env(workdir: str = None, **overrides: str) -> str:
+    # Must run before anything under app/ is imported: services read their
+    # configuration from the environment at import time
+    workdir = workdir or tempfile.mkdtemp(prefix="chatbot-bench-")
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{workdir}/bench.db",
+        "NEO4J_URI": "bolt://localhost:7687",
+        "NEO4J_USER": "neo4j",
+        "NEO4J_PASSWORD": "unused",
+        "GRAPH_BACKEND": "memory",
+        "CLAUDE_BACKEND": "stub",
+        "QUERY_CACHE_BACKEND": "none",
+    })
+    os.environ.update(overrides)
+    return workdir
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples: List[float], elapsed: float) -> Dict[str, float]:
+    return {
+        "count": len(samples),
+        "throughput_per_s": len(samples) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
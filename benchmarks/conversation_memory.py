@@ -0,0 +1,97 @@
+"""Prompt size and latency of /api/chat-style calls as a session grows.
+
+Compares sending the full history with the budgeted rolling window plus running
+summary kept by ConversationMemoryService. The stub model's latency grows with
+prompt size (--per-token-ms) to approximate prefill cost.
+
+Usage: python -m benchmarks.conversation_memory --turns 200 --budget 2000
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.models.database import Base, User
+from app.services.claude_service import ClaudeService
+from app.services.claude_scheduler import ClaudeScheduler
+from app.services.claude_stub import StubClaudeClient
+from app.services.conversation_memory import ConversationContext, ConversationMemoryService
+
+MESSAGES = [
+    "I spent the weekend hiking in the mountains with my dog.",
+    "At work I'm a backend engineer, mostly writing Python services.",
+    "Lately I have been learning to play chess online in the evenings.",
+    "My favourite food is ramen, I try a new place every month.",
+    "I also volunteer at the local library teaching kids to code.",
+]
+
+
+class PrefillStubClient(StubClaudeClient):
+    def __init__(self, latency: float, per_token: float):
+        super().__init__(latency)
+        self.prompt_tokens = []
+        create = self.messages.create
+
+        async def timed_create(**kwargs):
+            response = await create(**kwargs)
+            self.prompt_tokens.append(response.usage.input_tokens)
+            await asyncio.sleep(response.usage.input_tokens * per_token)
+            return response
+
+        self.messages.create = timed_create
+
+
+async def run_session(label, args, use_memory):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine, expire_on_commit=False)()
+    db.add(User(username="bench", email="bench@example.com", hashed_password="x"))
+    db.commit()
+
+    client = PrefillStubClient(args.latency, args.per_token_ms / 1000)
+    # One user sends every turn back to back, so per-user rate limiting is off
+    claude = ClaudeService(client=client, scheduler=ClaudeScheduler(user_rate=0))
+    memory = ConversationMemoryService(db, token_budget=args.budget)
+    history = []
+    latencies = []
+
+    for turn in range(args.turns):
+        message = MESSAGES[turn % len(MESSAGES)]
+        started = time.perf_counter()
+        if use_memory:
+            context = await memory.get_context(1)
+        else:
+            context = ConversationContext(turns=list(history))
+        reply = await claude.process_message("1", message, context)
+        if use_memory:
+            await memory.record_exchange(1, message, reply)
+        else:
+            history.extend([{"role": "user", "content": message}, {"role": "assistant", "content": reply}])
+        latencies.append(time.perf_counter() - started)
+
+    print(f"{label}:")
+    for checkpoint in sorted({1, 10, 50, 100, args.turns}):
+        if checkpoint <= args.turns:
+            print(f"  turn {checkpoint:>4}: prompt {client.prompt_tokens[checkpoint - 1]:>6} tokens, "
+                  f"latency {latencies[checkpoint - 1] * 1000:7.1f} ms")
+    print(f"  total {sum(latencies):.2f}s, max prompt {max(client.prompt_tokens)} tokens")
+    db.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--budget", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--per-token-ms", type=float, default=0.01)
+    args = parser.parse_args()
+
+    await run_session("full history", args, use_memory=False)
+    await run_session(f"rolling window + summary (budget {args.budget})", args, use_memory=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+"""Model calls, tokens and latency for the two characteristic extraction modes.
+
+Each job is what /api/chat does for one message. In "reply" mode the chat call
+carries the extraction instructions and the reply is parsed; in "batched" mode
+the chat call is a plain reply and the message is extracted in a shared
+ExtractionBatcher request. Both modes make the chat calls, so the difference is
+the extraction cost: longer chat prompts and replies versus extra batch calls.
+
+Runs against the in-process stub model by default. Pass --base-url to go through
+the real anthropic client to benchmarks/fake_model_server.py instead.
+
+Usage: python -m benchmarks.extraction_batching --jobs 500 --batch-size 20 --window 0.05
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import summarize
+
+MESSAGES = [
+    "I spend most weekends hiking and climbing",
+    "I work as a data engineer building pipelines",
+    "Chess and go are my favourite games",
+    "I'm learning to cook Thai food",
+]
+
+
+def create_claude_service(args, mode):
+    from app.services.claude_scheduler import ClaudeScheduler
+    from app.services.claude_service import ClaudeService
+    from app.services.claude_stub import StubClaudeClient
+
+    # Every job is submitted at once, so admission limits are lifted to measure extraction alone
+    scheduler = ClaudeScheduler(
+        max_concurrency=args.concurrency, user_rate=0, max_queue=args.jobs, max_user_queue=args.jobs
+    )
+    if args.base_url:
+        import anthropic
+        client, stub = anthropic.AsyncAnthropic(api_key="fake", base_url=args.base_url, max_retries=0), None
+    else:
+        client = stub = StubClaudeClient(latency=args.latency)
+    claude = ClaudeService(client=client, scheduler=scheduler)
+    claude.extraction_mode = mode
+    return claude, stub
+
+
+def token_totals():
+    from app.services.claude_service import CLAUDE_TOKENS
+
+    values = CLAUDE_TOKENS.values()
+    return values.get(("input",), 0.0), values.get(("output",), 0.0)
+
+
+async def run_mode(mode, args):
+    from app.services.extraction_batcher import ExtractionBatcher
+
+    claude, stub = create_claude_service(args, mode)
+    batcher = ExtractionBatcher(claude, max_batch=args.batch_size, max_wait=args.window)
+    chat_latencies, job_latencies = [], []
+    results = {}
+    tokens_before = token_totals()
+
+    async def job(index):
+        user_id = str(index % args.users)
+        item_id = f"{user_id}:{index}"
+        message = MESSAGES[index % len(MESSAGES)]
+        started = time.perf_counter()
+        reply = await claude.process_message(user_id, message)
+        claude.reply_text(reply)
+        chat_latencies.append(time.perf_counter() - started)
+        # The same split as extract_job_characteristics in app/main.py
+        if mode == "batched":
+            results[item_id] = await batcher.extract(item_id, message)
+        else:
+            results[item_id] = await claude.extract_characteristics(reply)
+        job_latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(job(index) for index in range(args.jobs)))
+    elapsed = time.perf_counter() - started
+    await batcher.close()
+    await claude.close()
+
+    chat = summarize(chat_latencies, elapsed)
+    jobs = summarize(job_latencies, elapsed)
+    calls = stub.messages.calls if stub else claude.stats["completed"]
+    input_tokens, output_tokens = (after - before for after, before in zip(token_totals(), tokens_before))
+    extracted = sum(1 for characteristics in results.values() if characteristics)
+    print(f"{mode}: {calls} model calls for {args.jobs} chats, {input_tokens:.0f} input / {output_tokens:.0f} output tokens, "
+          f"characteristics for {extracted} jobs")
+    print(f"  chat reply p50 {chat['p50_ms']:.1f} ms, p99 {chat['p99_ms']:.1f} ms; "
+          f"extracted p50 {jobs['p50_ms']:.1f} ms, p99 {jobs['p99_ms']:.1f} ms, {jobs['throughput_per_s']:.1f} jobs/s")
+    if mode == "batched":
+        stats = batcher.get_stats()
+        print(f"  avg batch {stats['avg_batch_size']:.1f}/{stats['max_batch']}, fill ratio {stats['fill_ratio']:.2f}, "
+              f"avg wait {stats['avg_wait_seconds'] * 1000:.1f} ms (window {stats['wait_window_seconds'] * 1000:.0f} ms), "
+              f"{stats['full_flushes']} full / {stats['timer_flushes']} timer flushes")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=500)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--window", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent model calls")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub model latency in seconds")
+    parser.add_argument("--base-url", help="fake model server URL, e.g. http://127.0.0.1:8100")
+    args = parser.parse_args()
+
+    await run_mode("reply", args)
+    await run_mode("batched", args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""Junk-characteristic rate and parse throughput of the extraction parsers over a reply corpus.
+
+Each corpus line is {"reply": <raw Claude reply>, "expected": {key: value or
+[values]}}. A characteristic counts as junk when it is not in the expected set,
+i.e. it would have become a bogus node in Neo4j. Exits non-zero when the structured parser's
+junk rate exceeds --max-junk-rate.
+
+Usage: python -m benchmarks.extraction_corpus --repeat 2000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from app.services.characteristic_parser import extract_characteristics
+from app.services.claude_service import ClaudeService
+from app.services.claude_stub import StubClaudeClient
+from app.services.vocabulary import canonical_key
+
+CORPUS = os.path.join(os.path.dirname(__file__), "data", "extraction_corpus.jsonl")
+
+
+def load_corpus(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def expected_pairs(expected):
+    return {
+        (key, value.lower())
+        for key, values in expected.items()
+        for value in (values if isinstance(values, list) else [values])
+    }
+
+
+def score(corpus, parse):
+    extracted = junk = expected_total = recalled = 0
+    for entry in corpus:
+        expected = expected_pairs(entry["expected"])
+        # The legacy parser returns a dict, the structured one (key, value) pairs
+        parsed = parse(entry["reply"])
+        found = {(canonical_key(key), value.lower()) for key, value in (parsed.items() if isinstance(parsed, dict) else parsed)}
+        extracted += len(found)
+        junk += len(found - expected)
+        expected_total += len(expected)
+        recalled += len(found & expected)
+    return {
+        "extracted": extracted,
+        "junk": junk,
+        "junk_rate": junk / extracted if extracted else 0.0,
+        "recall": recalled / expected_total if expected_total else 1.0,
+    }
+
+
+def throughput(corpus, parse, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for entry in corpus:
+            parse(entry["reply"])
+    return repeat * len(corpus) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--max-junk-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    legacy = ClaudeService(client=StubClaudeClient())._extract_characteristics
+    results = {}
+    for label, parse in (("lines (legacy)", legacy), ("structured", extract_characteristics)):
+        results[label] = dict(score(corpus, parse), replies_per_s=throughput(corpus, parse, args.repeat))
+        stats = results[label]
+        print(f"{label:>15}: {stats['extracted']:>3} extracted, {stats['junk']:>3} junk "
+              f"({stats['junk_rate']:.0%}), recall {stats['recall']:.0%}, {stats['replies_per_s']:,.0f} replies/s")
+
+    if results["structured"]["junk_rate"] > args.max_junk_rate:
+        print(f"structured junk rate above {args.max_junk_rate:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
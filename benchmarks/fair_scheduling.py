@@ -0,0 +1,148 @@
+"""Latency for ordinary users while one user floods Claude, with and without the fair scheduler.
+
+A heavy user keeps --heavy-concurrency chat requests in flight and retries
+immediately when rejected. Light users chat with think time between messages,
+and search users run searches. The "fifo" mode reproduces the old single
+semaphore; "fair" uses ClaudeScheduler with per-user token buckets, weighted
+fair queueing and 429 admission control.
+
+Runs against the in-process stub model by default; pass --base-url to go
+through the anthropic client to benchmarks/fake_model_server.py instead.
+
+Usage: python -m benchmarks.fair_scheduling --duration 10 --concurrency 4 --latency 0.2
+"""
+import argparse
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+from benchmarks.common import summarize
+
+
+class FifoScheduler:
+    # The previous behaviour: one semaphore, first come first served, no admission control
+    def __init__(self, max_concurrency):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def admit(self, user_id, request_class):
+        pass
+
+    @asynccontextmanager
+    async def slot(self, user_id, request_class, admitted=False):
+        async with self._semaphore:
+            yield
+
+    def get_stats(self):
+        return {}
+
+
+def create_client(args):
+    if args.base_url:
+        import anthropic
+        return anthropic.AsyncAnthropic(api_key="fake", base_url=args.base_url, max_retries=0)
+    from app.services.claude_stub import StubClaudeClient
+    return StubClaudeClient(latency=args.latency)
+
+
+async def run_mode(mode, args):
+    from app.services.claude_scheduler import ClaudeScheduler
+    from app.services.claude_service import ClaudeService
+
+    if mode == "fifo":
+        scheduler = FifoScheduler(args.concurrency)
+    else:
+        scheduler = ClaudeScheduler(
+            max_concurrency=args.concurrency,
+            user_rate=args.user_rate,
+            user_burst=args.user_burst,
+            max_queue=args.max_queue,
+            max_user_queue=args.max_user_queue,
+        )
+    claude = ClaudeService(client=create_client(args), scheduler=scheduler)
+    rng = random.Random(args.seed)
+    deadline = time.perf_counter() + args.duration
+    latencies = {"heavy": [], "light": [], "search": []}
+    rejected = {"heavy": 0, "light": 0, "search": 0}
+
+    async def call(group, fn):
+        started = time.perf_counter()
+        try:
+            await fn()
+        except HTTPException as e:
+            rejected[group] += 1
+            return float(e.headers.get("Retry-After", "1"))
+        latencies[group].append(time.perf_counter() - started)
+        return 0.0
+
+    async def heavy():
+        while time.perf_counter() < deadline:
+            # A misbehaving script: ignores Retry-After and tries again almost at once
+            if await call("heavy", lambda: claude.process_message("heavy", "spam spam spam")):
+                await asyncio.sleep(0.05)
+
+    async def light(user_id):
+        await asyncio.sleep(rng.uniform(0, args.think_time))
+        while time.perf_counter() < deadline:
+            retry_after = await call("light", lambda: claude.process_message(user_id, "I like hiking"))
+            await asyncio.sleep(max(retry_after, rng.uniform(0.5, 1.5) * args.think_time))
+
+    async def search(user_id):
+        await asyncio.sleep(rng.uniform(0, args.think_time))
+        while time.perf_counter() < deadline:
+            retry_after = await call("search", lambda: claude.find_matching_users("people into chess", user_id))
+            await asyncio.sleep(max(retry_after, rng.uniform(0.5, 1.5) * args.think_time))
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(heavy() for _ in range(args.heavy_concurrency)),
+        *(light(f"light{i}") for i in range(args.light_users)),
+        *(search(f"search{i}") for i in range(args.search_users)),
+    )
+    elapsed = time.perf_counter() - started
+    await claude.close()
+
+    print(f"{mode}:")
+    for group, samples in latencies.items():
+        stats = summarize(samples, elapsed)
+        print(f"  {group:<7} completed={stats['count']:<6} rejected={rejected[group]:<6} "
+              f"req/s={stats['throughput_per_s']:<7.1f} p50={stats['p50_ms']:.0f}ms "
+              f"p95={stats['p95_ms']:.0f}ms p99={stats['p99_ms']:.0f}ms")
+    if mode == "fair":
+        print(f"  scheduler {scheduler.get_stats()}")
+
+
+def print_queue_wait():
+    from app.services.claude_scheduler import QUEUE_WAIT
+
+    for (request_class,), value in sorted(QUEUE_WAIT.values().items()):
+        mean = value["sum"] / value["count"] * 1000 if value["count"] else 0.0
+        print(f"  queue wait {request_class:<8} mean={mean:.0f}ms over {value['count']} requests")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=4, help="global cap on concurrent model calls")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub model latency in seconds")
+    parser.add_argument("--base-url", help="fake model server URL, e.g. http://127.0.0.1:8100")
+    parser.add_argument("--heavy-concurrency", type=int, default=40)
+    parser.add_argument("--light-users", type=int, default=10)
+    parser.add_argument("--search-users", type=int, default=5)
+    parser.add_argument("--think-time", type=float, default=1.0, help="seconds between a light user's requests")
+    parser.add_argument("--user-rate", type=float, default=1.0)
+    parser.add_argument("--user-burst", type=int, default=10)
+    parser.add_argument("--max-queue", type=int, default=200)
+    parser.add_argument("--max-user-queue", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    await run_mode("fifo", args)
+    await run_mode("fair", args)
+    print_queue_wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
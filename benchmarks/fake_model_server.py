@@ -0,0 +1,43 @@
+"""Local fake of the Anthropic Messages API backed by the offline stub model.
+
+Lets the real anthropic client (and so ClaudeService's HTTP path, retries and
+timeouts) run without network access or API keys.
+
+Usage: uvicorn benchmarks.fake_model_server:app --port 8100
+       ANTHROPIC_BASE_URL=http://127.0.0.1:8100 ANTHROPIC_API_KEY=fake python -m ...
+"""
+import os
+import uuid
+
+from fastapi import FastAPI, Request
+
+from app.services.claude_stub import StubMessages
+
+app = FastAPI()
+messages = StubMessages(latency=float(os.getenv("FAKE_MODEL_LATENCY", "0.2")))
+
+
+@app.post("/v1/messages")
+async def create_message(request: Request):
+    body = await request.json()
+    response = await messages.create(
+        model=body["model"],
+        max_tokens=body["max_tokens"],
+        system=body.get("system", ""),
+        messages=body["messages"],
+    )
+    return {
+        "id": f"msg_{uuid.uuid4().hex}",
+        "type": "message",
+        "role": "assistant",
+        "model": body["model"],
+        "content": [{"type": "text", "text": block.text} for block in response.content],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": response.usage.input_tokens, "output_tokens": response.usage.output_tokens},
+    }
+
+
+@app.get("/stats")
+async def stats():
+    return {"calls": messages.calls}
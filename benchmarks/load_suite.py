@@ -0,0 +1,239 @@
+"""End-to-end load test of the main endpoints against offline stand-ins.
+
+Seeds SQLite with users, messages and characteristics, swaps Neo4j for the
+in-memory graph and Claude for the stub model (or the fake model server via
+--claude-base-url), then drives /token, /api/chat, /api/search-users,
+/api/conversations, /api/messages/{id}, /api/search-messages and
+/api/suggestions in-process.
+Each endpoint is measured on its own and then all together in a mixed phase.
+Results are written as JSON; pass --compare to diff against an earlier run.
+
+Usage: python -m benchmarks.load_suite --users 500 --messages 20000 --requests 300 --concurrency 32
+       python -m benchmarks.load_suite --compare benchmarks/results/<earlier>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime
+
+from benchmarks.common import configure_offline_env, summarize
+
+INTERESTS = [
+    "hiking", "chess", "photography", "cooking", "climbing", "gardening", "jazz", "painting",
+    "running", "cycling", "poetry", "astronomy", "baking", "surfing", "knitting", "robotics",
+]
+PROFESSIONS = ["engineer", "teacher", "designer", "nurse", "chef", "writer", "scientist", "lawyer"]
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def seed(args, rng):
+    from sqlalchemy import insert
+    from app.main import graph_service
+    from app.models.database import Message, SessionLocal, User, init_db
+    from app.services.auth import pwd_context
+
+    init_db()
+    # Every user shares one hash so seeding does not spend minutes in bcrypt
+    hashed = pwd_context.hash("password")
+    db = SessionLocal()
+    db.execute(insert(User), [
+        {"username": f"user{i}", "email": f"user{i}@example.com", "hashed_password": hashed}
+        for i in range(1, args.users + 1)
+    ])
+    # Conversations cluster around a few partners per user, as real inboxes do
+    partners = {i: rng.sample(range(1, args.users + 1), min(args.partners, args.users)) for i in range(1, args.users + 1)}
+    rows = []
+    for n in range(args.messages):
+        sender = rng.randint(1, args.users)
+        recipient = rng.choice([p for p in partners[sender] if p != sender] or [sender % args.users + 1])
+        rows.append({
+            "sender_id": sender,
+            "recipient_id": recipient,
+            "content": f"message {n} about {rng.choice(INTERESTS)}",
+            "timestamp": datetime.utcnow(),
+            "read": rng.random() < 0.7,
+        })
+    for start in range(0, len(rows), 5000):
+        db.execute(insert(Message), rows[start:start + 5000])
+    db.commit()
+    db.close()
+
+    graph_rows = []
+    for i in range(1, args.users + 1):
+        for interest in rng.sample(INTERESTS, 3):
+            graph_rows.append({"username": str(i), "name": "interest", "value": interest})
+        graph_rows.append({"username": str(i), "name": "profession", "value": rng.choice(PROFESSIONS)})
+    graph_service.add_characteristics_batch(graph_rows)
+    return partners
+
+
+def request_factories(args, rng, partners, tokens):
+    def auth(user_id):
+        return {"Authorization": f"Bearer {tokens[user_id]}"}
+
+    def user():
+        return rng.randint(1, args.users)
+
+    def login(client):
+        return client.post("/token", data={"username": f"user{user()}", "password": "password"})
+
+    def chat(client):
+        return client.post("/api/chat", params={"message": f"I have been getting into {rng.choice(INTERESTS)}"}, headers=auth(user()))
+
+    def search(client):
+        return client.post("/api/search-users", params={"query": f"people who enjoy {rng.choice(INTERESTS)}"}, headers=auth(user()))
+
+    def conversations(client):
+        return client.get("/api/conversations", headers=auth(user()))
+
+    def messages(client):
+        user_id = user()
+        return client.get(f"/api/messages/{rng.choice(partners[user_id])}", headers=auth(user_id))
+
+    def search_messages(client):
+        return client.get("/api/search-messages", params={"q": rng.choice(INTERESTS)}, headers=auth(user()))
+
+    def suggestions(client):
+        return client.get("/api/suggestions", headers=auth(user()))
+
+    return {
+        "/token": login,
+        "/api/chat": chat,
+        "/api/search-users": search,
+        "/api/conversations": conversations,
+        "/api/messages/{id}": messages,
+        "/api/search-messages": search_messages,
+        "/api/suggestions": suggestions,
+    }
+
+
+async def run_phase(client, factories, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = {name: [] for name in factories}
+    errors = {name: 0 for name in factories}
+    names = list(factories)
+
+    async def one(index):
+        name = names[index % len(names)]
+        async with semaphore:
+            started = time.perf_counter()
+            response = await factories[name](client)
+            elapsed = time.perf_counter() - started
+        if response.status_code == 200:
+            latencies[name].append(elapsed)
+        else:
+            errors[name] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests * len(names))))
+    elapsed = time.perf_counter() - started
+    return {name: dict(summarize(latencies[name], elapsed), errors=errors[name]) for name in names}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def print_results(results):
+    print(f"{'phase':<10} {'endpoint':<22} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for phase, endpoints in results.items():
+        for name, stats in endpoints.items():
+            print(f"{phase:<10} {name:<22} {stats['throughput_per_s']:>9.1f} {stats['p50_ms']:>9.1f} "
+                  f"{stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['errors']:>7}")
+
+
+def compare(baseline_path, current):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nchange vs {baseline_path} ({baseline.get('commit')}): ratio current/baseline, >1 is slower")
+    for phase, endpoints in current["results"].items():
+        for name, stats in endpoints.items():
+            before = baseline["results"].get(phase, {}).get(name)
+            if not before:
+                continue
+            ratios = [
+                f"{metric} x{stats[metric] / before[metric]:.2f}" if before[metric] else f"{metric} n/a"
+                for metric in ("p50_ms", "p95_ms", "p99_ms")
+            ]
+            print(f"{phase:<10} {name:<22} " + "  ".join(ratios))
+
+
+async def run(args):
+    import httpx
+    from app.main import app
+    from app.services.auth import create_access_token
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    partners = seed(args, rng)
+    print(f"seeded {args.users} users and {args.messages} messages in {time.perf_counter() - started:.1f}s")
+    tokens = {i: create_access_token({"sub": f"user{i}"}) for i in range(1, args.users + 1)}
+    factories = request_factories(args, rng, partners, tokens)
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            # Warm-up primes caches and pools so the first phase is not penalised
+            await run_phase(client, factories, max(1, args.requests // 10), args.concurrency)
+            results["isolated"] = {}
+            for name, factory in factories.items():
+                results["isolated"].update(await run_phase(client, {name: factory}, args.requests, args.concurrency))
+            results["mixed"] = await run_phase(client, factories, args.requests, args.concurrency)
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "results": results,
+    }
+    print_results(results)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.utcnow():%Y%m%dT%H%M%S}-{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults written to {output}")
+    if args.compare:
+        compare(args.compare, report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--partners", type=int, default=5, help="conversation partners per user")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and phase")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--claude-latency", type=float, default=0.2, help="stub model latency in seconds")
+    parser.add_argument("--claude-base-url", help="use the anthropic client against a fake model server instead of the stub")
+    parser.add_argument("--bcrypt-rounds", type=int, default=10)
+    parser.add_argument("--user-rate", type=float, default=0, help="per-user Claude requests per second, 0 disables the limit")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON results path, defaults to benchmarks/results/<time>-<commit>.json")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    overrides = {
+        "CLAUDE_STUB_LATENCY": str(args.claude_latency),
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+        "CLAUDE_USER_RATE": str(args.user_rate),
+        "SIMILARITY_REBUILD_INTERVAL": "0",
+    }
+    if args.claude_base_url:
+        overrides.update(CLAUDE_BACKEND="anthropic", ANTHROPIC_BASE_URL=args.claude_base_url, ANTHROPIC_API_KEY="fake")
+    configure_offline_env(**overrides)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Login storm: /token throughput and the latency of an unrelated endpoint while it runs.
+
+Run from the repository root. Compare --workers 0 (bcrypt inline on the event
+loop) with the default worker pool.
+
+Usage: python -m benchmarks.login_storm --logins 100 --concurrency 50 --workers 4
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import configure_offline_env, summarize
+
+
+async def run(args):
+    import httpx
+    from app.main import app
+    from app.models.database import SessionLocal, User, init_db
+    from app.services.auth import create_access_token, password_hasher, pwd_context
+
+    init_db()
+    db = SessionLocal()
+    db.add(User(username="storm", email="storm@example.com", hashed_password=pwd_context.hash("password")))
+    db.commit()
+    db.close()
+
+    async with app.router.lifespan_context(app):
+        token = create_access_token({"sub": "storm"})
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            semaphore = asyncio.Semaphore(args.concurrency)
+            login_latencies, probe_latencies, statuses = [], [], {}
+            storm_done = asyncio.Event()
+
+            async def login():
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.post("/token", data={"username": "storm", "password": "password"})
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                    if response.status_code == 200:
+                        login_latencies.append(time.perf_counter() - started)
+
+            async def probe():
+                headers = {"Authorization": f"Bearer {token}"}
+                while not storm_done.is_set():
+                    started = time.perf_counter()
+                    await client.get("/api/conversations", headers=headers)
+                    probe_latencies.append(time.perf_counter() - started)
+                    await asyncio.sleep(0.01)
+
+            probe_task = asyncio.create_task(probe())
+            started = time.perf_counter()
+            await asyncio.gather(*(login() for _ in range(args.logins)))
+            elapsed = time.perf_counter() - started
+            storm_done.set()
+            await probe_task
+
+    print(f"hash workers={args.workers} bcrypt rounds={args.rounds} statuses={statuses}")
+    print("/token              ", summarize(login_latencies, elapsed))
+    print("/api/conversations  ", summarize(probe_latencies, elapsed))
+    print("hasher              ", password_hasher.get_stats())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-pending", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=12)
+    args = parser.parse_args()
+
+    configure_offline_env(
+        PASSWORD_HASH_WORKERS=str(args.workers),
+        PASSWORD_HASH_MAX_PENDING=str(args.max_pending),
+        BCRYPT_ROUNDS=str(args.rounds),
+    )
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""Hot-table query latency and database size before and after archiving old messages.
+
+Seeds SQLite with a year of messages, measures MessageService reads, moves
+everything older than --archive-days into segment files, compacts and
+vacuums, then measures again. Paging all the way back through sampled
+conversations must return the same messages before and after archiving.
+Archiving runs in two steps with deletes and a compaction in between, and a
+single long-lived reader is checked against a fresh one after each step, so
+stale block caches show up as mismatches.
+
+Usage: python -m benchmarks.message_archive --users 300 --messages 300000 --archive-days 90
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import configure_offline_env, summarize
+
+
+def seed(args, rng):
+    from sqlalchemy import insert
+    from app.models.database import Message, SessionLocal, User, init_db
+
+    init_db()
+    db = SessionLocal()
+    db.execute(insert(User), [
+        {"username": f"user{i}", "email": f"user{i}@example.com", "hashed_password": "unused"}
+        for i in range(1, args.users + 1)
+    ])
+    partners = {i: rng.sample(range(1, args.users + 1), min(args.partners, args.users)) for i in range(1, args.users + 1)}
+    # Timestamps rise with ids, spread evenly over the last --history-days
+    started = datetime.utcnow() - timedelta(days=args.history_days)
+    step = timedelta(days=args.history_days) / args.messages
+    rows = []
+    for n in range(args.messages):
+        sender = rng.randint(1, args.users)
+        timestamp = started + step * n
+        rows.append({
+            "sender_id": sender,
+            "recipient_id": rng.choice(partners[sender]),
+            "content": f"message {n} " + " ".join(rng.choice(["hey", "lunch", "tomorrow", "photos", "trip"]) for _ in range(8)),
+            "timestamp": timestamp,
+            # Everything but the last week has been read
+            "read": timestamp < datetime.utcnow() - timedelta(days=7),
+        })
+    for start in range(0, len(rows), 5000):
+        db.execute(insert(Message), rows[start:start + 5000])
+    db.commit()
+    db.close()
+    return partners
+
+
+async def measure(service, pairs, limit):
+    first_pages, deep_pages, inbox = [], [], []
+    histories = {}
+    started = time.perf_counter()
+    for user_id, partner_id in pairs:
+        began = time.perf_counter()
+        await service.get_user_conversations(user_id, limit=20)
+        inbox.append(time.perf_counter() - began)
+
+        history, before = [], None
+        while True:
+            began = time.perf_counter()
+            page = await service.get_conversation(user_id, partner_id, limit=limit, before=before)
+            (deep_pages if before is not None else first_pages).append(time.perf_counter() - began)
+            history.extend(message.id for message in page)
+            if len(page) < limit:
+                break
+            before = page[-1].id
+        histories[(user_id, partner_id)] = history
+    elapsed = time.perf_counter() - started
+    return {
+        "first_page": summarize(first_pages, elapsed),
+        "deep_pages": summarize(deep_pages, elapsed),
+        "conversations": summarize(inbox, elapsed),
+    }, histories
+
+
+def database_bytes(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+
+
+def archive_bytes(root):
+    return sum(os.path.getsize(os.path.join(directory, name)) for directory, _, names in os.walk(root) for name in names)
+
+
+def print_stats(label, stats):
+    for name, values in stats.items():
+        print(f"{label:<8} {name:<14} n={values['count']:<6} p50={values['p50_ms']:.2f}ms "
+              f"p95={values['p95_ms']:.2f}ms p99={values['p99_ms']:.2f}ms")
+
+
+async def run(args, workdir):
+    from sqlalchemy.orm import Session
+    from app.models.database import ArchiveBlock, Message, SessionLocal, create_script_engine
+    from app.services.message_archive import MessageArchive, archive_cutoff
+    from app.services.message_service import MessageService
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    partners = seed(args, rng)
+    print(f"seeded {args.users} users and {args.messages} messages in {time.perf_counter() - started:.1f}s")
+    pairs = [(user_id, rng.choice(partners[user_id])) for user_id in rng.sample(range(1, args.users + 1), args.sample)]
+    database = os.path.join(workdir, "bench.db")
+    archive_root = os.path.join(workdir, "archive")
+
+    db = SessionLocal()
+    before_stats, before_histories = await measure(MessageService(db), pairs, args.limit)
+    db.close()
+    size_before = database_bytes(database)
+
+    # The reader plays the app's long-lived archive instance and keeps its block
+    # cache through every maintenance run below; the writer is the nightly script.
+    # Its cache holds every block, so nothing stale is evicted before it is read.
+    reader = MessageArchive(archive_root, cache_size=args.messages)
+    writer = MessageArchive(archive_root)
+    expected = dict(before_histories)
+    archive_seconds = compact_seconds = 0.0
+    with Session(create_script_engine()) as session:
+        # An older cutoff first, so the second run appends blocks after compaction has freed rows
+        started = time.perf_counter()
+        archived = writer.archive_older_than(session, archive_cutoff(args.archive_days * 2))
+        archive_seconds += time.perf_counter() - started
+        await check_histories(reader, pairs, args.limit, expected, "first archive run")
+
+        # Delete the conversation holding the newest blocks outright, through the app.
+        # Compacting it drops the highest block ids, which the next run's blocks may be handed.
+        db = SessionLocal()
+        service = MessageService(db, archive=reader)
+        newest = session.query(ArchiveBlock).order_by(ArchiveBlock.id.desc()).first()
+        deleted = set()
+        for message in reader.read_before(db, newest.user_lo, newest.user_hi, None, args.messages):
+            if await service.delete_message(message.id, newest.user_lo):
+                deleted.add(message.id)
+        db.close()
+        for pair in pairs:
+            if tuple(sorted(pair)) == (newest.user_lo, newest.user_hi):
+                expected[pair] = [message_id for message_id in expected[pair] if message_id not in deleted]
+        started = time.perf_counter()
+        compacted = writer.compact(session)
+        compact_seconds += time.perf_counter() - started
+        started = time.perf_counter()
+        archived += writer.archive_older_than(session, archive_cutoff(args.archive_days))
+        archive_seconds += time.perf_counter() - started
+        await check_histories(reader, pairs, args.limit, expected, "compaction and a second archive run")
+
+        # Then the oldest message of each sampled conversation, and the full compaction
+        db = SessionLocal()
+        service = MessageService(db, archive=reader)
+        for user_id, partner_id in pairs:
+            history = expected[(user_id, partner_id)]
+            if history and await service.delete_message(history[-1], user_id):
+                expected[(user_id, partner_id)] = history[:-1]
+        db.close()
+        started = time.perf_counter()
+        compacted += writer.compact(session)
+        compact_seconds += time.perf_counter() - started
+        hot = session.query(Message).count()
+    with create_script_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        connection.exec_driver_sql("VACUUM")
+    print(f"archived {archived} messages in {archive_seconds:.1f}s, compacted {compacted} conversations "
+          f"in {compact_seconds:.1f}s, {hot} messages left hot")
+    await check_histories(reader, pairs, args.limit, expected, "final compaction")
+
+    # A fresh archive instance, so the after numbers start from cold block caches
+    db = SessionLocal()
+    after_stats, after_histories = await measure(MessageService(db, archive=MessageArchive(archive_root)), pairs, args.limit)
+    db.close()
+
+    print_stats("before", before_stats)
+    print_stats("after", after_stats)
+    print(f"database {size_before / 1e6:.1f}MB -> {database_bytes(database) / 1e6:.1f}MB, "
+          f"archive segments {archive_bytes(archive_root) / 1e6:.1f}MB")
+    report_mismatches(pairs, expected, after_histories, "after archiving")
+
+
+async def check_histories(archive, pairs, limit, expected, stage):
+    from app.models.database import ArchiveBlock, SessionLocal
+    from app.services.message_archive import MessageArchive
+    from app.services.message_service import MessageService
+
+    # A new session per stage, like a new request, but the same archive instance throughout
+    db = SessionLocal()
+    # Every archived conversation must read the same through the long-lived
+    # instance as through a fresh one, not just the sampled ones
+    fresh = MessageArchive(archive.root)
+    conversations = db.query(ArchiveBlock.user_lo, ArchiveBlock.user_hi).distinct().order_by(
+        ArchiveBlock.user_lo, ArchiveBlock.user_hi
+    ).all()
+    stale = [
+        (user_lo, user_hi) for user_lo, user_hi in conversations
+        if [(m.id, m.content) for m in archive.read_before(db, user_lo, user_hi, None, 1000000)]
+        != [(m.id, m.content) for m in fresh.read_before(db, user_lo, user_hi, None, 1000000)]
+    ]
+    print(f"long-lived reader agrees with a fresh one after {stage}: {not stale}")
+    if stale:
+        raise SystemExit(f"stale archive reads for {len(stale)} conversations, e.g. {stale[0]}")
+    _, histories = await measure(MessageService(db, archive=archive), pairs, limit)
+    db.close()
+    report_mismatches(pairs, expected, histories, f"long-lived reader after {stage}")
+
+
+def report_mismatches(pairs, expected, histories, label):
+    mismatched = [pair for pair in pairs if expected[pair] != histories[pair]]
+    print(f"conversation histories identical, {label}: {not mismatched}")
+    if mismatched:
+        raise SystemExit(f"history differs for {len(mismatched)} conversations, e.g. {mismatched[0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--messages", type=int, default=300000)
+    parser.add_argument("--partners", type=int, default=5, help="conversation partners per user")
+    parser.add_argument("--history-days", type=float, default=365)
+    parser.add_argument("--archive-days", type=float, default=90)
+    parser.add_argument("--sample", type=int, default=50, help="conversations paged through in each phase")
+    parser.add_argument("--limit", type=int, default=50, help="messages per page")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    workdir = configure_offline_env()
+    os.environ["MESSAGE_ARCHIVE_DIR"] = os.path.join(workdir, "archive")
+    asyncio.run(run(args, workdir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Count SQLite queries and Neo4j sessions issued by ProfileService search and suggestions.
+
+Usage: python -m benchmarks.profile_round_trips --users 200
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.models.database import Base, User
+from app.services.profile_service import ProfileService
+
+
+class CountingGraph:
+    def __init__(self, user_ids):
+        self.user_ids = [str(user_id) for user_id in user_ids]
+        self.sessions = 0
+
+    def find_users_by_characteristics(self, criteria):
+        self.sessions += 1
+        return self.user_ids
+
+    def search_users_ranked(self, characteristics, limit, weights=None):
+        self.sessions += 1
+        return [(user_id, 1.0) for user_id in self.user_ids[:limit]]
+
+    def find_similar_users(self, username, limit):
+        self.sessions += 1
+        return [user_id for user_id in self.user_ids if user_id != username][:limit]
+
+    def get_user_characteristics(self, username):
+        self.sessions += 1
+        return {"interest": "hiking"}
+
+    def get_users_characteristics(self, usernames):
+        self.sessions += 1
+        return {username: {"interest": "hiking"} for username in usernames}
+
+
+def legacy_search_users(db, graph, criteria, exclude_user_id):
+    users = []
+    for username in graph.find_users_by_characteristics(criteria):
+        user = db.query(User).filter(User.id == int(username)).first()
+        if user and user.id != exclude_user_id:
+            users.append({
+                "id": user.id,
+                "username": user.username,
+                "characteristics": graph.get_user_characteristics(str(user.id))
+            })
+    return users
+
+
+async def measure(label, db, graph, counter, fn):
+    counter["queries"] = 0
+    graph.sessions = 0
+    started = time.perf_counter()
+    results = fn()
+    if asyncio.iscoroutine(results):
+        results = await results
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"{label:<32} results={len(results):<5} sqlite_queries={counter['queries']:<5} "
+          f"neo4j_sessions={graph.sessions:<5} elapsed_ms={elapsed:.1f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    counter = {"queries": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_query(*_):
+        counter["queries"] += 1
+
+    db = sessionmaker(bind=engine)()
+    db.add_all([User(username=f"user{i}", email=f"user{i}@example.com", hashed_password="x") for i in range(args.users + 1)])
+    db.commit()
+
+    ids = [user_id for (user_id,) in db.query(User.id).all()]
+    graph = CountingGraph(ids)
+    service = ProfileService(db, graph)
+    criteria = {"interest": "hiking"}
+
+    await measure("search_users (per-row)", db, graph, counter,
+            lambda: legacy_search_users(db, graph, criteria, ids[0]))
+    await measure("search_users (batched)", db, graph, counter,
+            lambda: service.search_users(criteria, exclude_user_id=ids[0], limit=args.users))
+    await measure("get_user_suggestions (batched)", db, graph, counter,
+            lambda: service.get_user_suggestions(ids[0], limit=args.users))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,21 @@
+from dotenv import load_dotenv
+import time
+
+# Database settings are read when app.models.database is imported
+load_dotenv()
+
+from app.models.database import MESSAGE_SEARCH_AVAILABLE, create_script_engine, init_db, rebuild_message_search
+
+def build_search_index():
+    if not MESSAGE_SEARCH_AVAILABLE:
+        print("Message search is only available with the SQLite backend")
+        return
+    # Creates the tables first so the rebuild also works on a fresh database
+    init_db()
+    started = time.perf_counter()
+    with create_script_engine().begin() as connection:
+        indexed = rebuild_message_search(connection)
+    print(f"Indexed {indexed} messages in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    build_search_index()
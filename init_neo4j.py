@@ -1,20 +1,18 @@
-from neo4j import GraphDatabase
-import os
 from dotenv import load_dotenv
 
+from app.services.graph_db import create_graph_service
+
 load_dotenv()
 
 def init_neo4j():
-    uri = os.getenv("NEO4J_URI")
-    user = os.getenv("NEO4J_USER")
-    password = os.getenv("NEO4J_PASSWORD")
-    
-    driver = GraphDatabase.driver(uri, auth=(user, password))
-    
-    with driver.session() as session:
-        # Create constraints
-        session.run("CREATE CONSTRAINT user_username IF NOT EXISTS FOR (u:User) REQUIRE u.username IS UNIQUE")
-        session.run("CREATE CONSTRAINT characteristic_name_value IF NOT EXISTS FOR (c:Characteristic) REQUIRE (c.name, c.value) IS UNIQUE")
-    
-    driver.close()
-    print("Neo4j database initialized successfully")
\ No newline at end of file
+    # One driver for schema setup and the backfill, closed before the app starts its own
+    graph_service = create_graph_service()
+    graph_service.connect()
+    try:
+        graph_service.create_schema()
+        updated = graph_service.backfill_vocabulary()
+    finally:
+        graph_service.close()
+    if updated:
+        print(f"Added search vocabulary to {updated} existing characteristics")
+    print("Neo4j database initialized successfully")